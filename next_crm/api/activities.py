@@ -1,30 +1,30 @@
+import hashlib
+import heapq
 import json
+from functools import lru_cache
+from html.parser import HTMLParser
+from itertools import islice
 
 import frappe
-from bs4 import BeautifulSoup
 from frappe import _
 from frappe.desk.form.load import get_docinfo
+from frappe.query_builder.functions import Count, Max
+from frappe.utils import cint, get_datetime
 
+from next_crm.api.communication import get_communication_previews
+from next_crm.api.pagination import decode_cursor, encode_cursor
+from next_crm.api.version import get_version_activities
 
-@frappe.whitelist()
-def get_activities(name):
-    if frappe.db.exists("Opportunity", name):
-        return get_opportunity_activities(name)
-    elif frappe.db.exists("Lead", name):
-        return get_lead_activities(name)
-    else:
-        frappe.throw(_("Document not found"), frappe.DoesNotExistError)
-
-
-def get_opportunity_activities(name):
-    get_docinfo("", "Opportunity", name)
-    docinfo = frappe.response["docinfo"]
-    opportunity_meta = frappe.get_meta("Opportunity")
-    opportunity_fields = {
-        field.fieldname: {"label": field.label, "options": field.options}
-        for field in opportunity_meta.fields
-    }
-    avoid_fields = [
+AVOID_FIELDS = {
+    "Lead": [
+        "converted",
+        "response_by",
+        "sla_creation",
+        "sla",
+        "first_response_time",
+        "first_responded_on",
+    ],
+    "Opportunity": [
         "party_name",
         "lead",
         "response_by",
@@ -32,372 +32,901 @@ def get_opportunity_activities(name):
         "sla",
         "first_response_time",
         "first_responded_on",
-    ]
+    ],
+}
+
+TIMELINE_ORDER = "creation desc"
+
+COMMUNICATION_ACTIVITY_FIELDS = [
+    "name",
+    "communication_type",
+    "communication_medium",
+    "creation",
+    "subject",
+    "content",
+    "sender_full_name",
+    "sender",
+    "recipients",
+    "cc",
+    "bcc",
+    "read_by_recipient",
+    "delivery_status",
+    "reference_doctype",
+]
+
+# content is left out, the timeline shows previews and loads bodies on expand
+LAZY_COMMUNICATION_FIELDS = [
+    field for field in COMMUNICATION_ACTIVITY_FIELDS if field != "content"
+]
 
-    doc = frappe.db.get_values(
-        "Opportunity", name, ["creation", "owner", "opportunity_from", "party_name"]
-    )[0]
-    opportunity_from = doc[2]
 
-    activities = []
-    calls = []
-    todos = []
-    events = []
-    attachments = []
-    creation_text = "created this opportunity"
+@frappe.whitelist()
+def get_activities(name):
+    doctype = get_activity_doctype(name)
+    records = get_activity_records(doctype, name)
+    return tuple(ACTIVITY_TABS[tab]["load"](records) for tab in ACTIVITY_TABS)
+
+
+@frappe.whitelist()
+def get_activity_tab(
+    name, tab, etag=None, with_content=False, limit=None, before=None
+):
+    """
+    Fetch a single tab of the activity panel of a Lead or Opportunity
+
+    :param tab: One of `activities`, `calls`, `notes`, `todos`, `events` and `attachments`
+    :param etag: ETag returned with the copy of the tab the client already has
+    :param with_content: Include the full body of emails instead of only a preview
+    :param limit: Only return the newest `limit` activities, for the `activities` tab
+    :param before: Only return activities created before this, for the `activities` tab
+    :return: `{"etag": str, "modified": bool, "data": list}`, `data` is left out if `etag` is still current
+    """
+    if tab not in ACTIVITY_TABS:
+        frappe.throw(_("Invalid activity tab {0}").format(tab))
+
+    doctype = get_activity_doctype(name)
+    frappe.has_permission(doctype, "read", name, throw=True)
 
-    if opportunity_from == "Lead":
-        lead = doc[3]
-        activities, calls, _notes, todos, events, attachments = get_lead_activities(
-            lead, False
+    params = ()
+    if tab == "activities":
+        params = (cint(with_content), cint(limit), before)
+    current_etag = get_activity_tab_etag(
+        tab, get_activity_record_refs(doctype, name), *params
+    )
+    if etag and etag == current_etag:
+        return {"etag": current_etag, "modified": False}
+
+    records = get_activity_records(doctype, name)
+    if tab == "activities":
+        data = load_activities_tab(
+            records,
+            with_content=cint(with_content),
+            limit=cint(limit),
+            before=get_datetime(before) if before else None,
         )
-        creation_text = "converted the lead to this opportunity"
+    else:
+        data = ACTIVITY_TABS[tab]["load"](records)
+    return {"etag": current_etag, "modified": True, "data": data}
 
-    activities.append(
-        {
-            "activity_type": "creation",
-            "creation": doc[0],
-            "owner": doc[1],
-            "data": creation_text,
-            "is_lead": False,
-        }
+
+@frappe.whitelist()
+def get_activity_tab_etags(name):
+    """
+    Return the current ETag of every activity tab, so a client can find out
+    which of its tabs are stale with one cheap request
+
+    :return: `{tab: etag}`
+    """
+    doctype = get_activity_doctype(name)
+    frappe.has_permission(doctype, "read", name, throw=True)
+    refs = get_activity_record_refs(doctype, name)
+    return {
+        tab: get_activity_tab_etag(tab, refs, *((0, 0, None) if tab == "activities" else ()))
+        for tab in ACTIVITY_TABS
+    }
+
+
+def get_activity_doctype(name):
+    if frappe.db.exists("Opportunity", name):
+        return "Opportunity"
+    elif frappe.db.exists("Lead", name):
+        return "Lead"
+    frappe.throw(_("Document not found"), frappe.DoesNotExistError)
+
+
+def get_activity_record_refs(doctype, name):
+    """
+    Return the `doctype` and `name` of the records whose activities are
+    shown, like `get_activity_records` but with at most one query
+
+    :return: `[_dict(doctype, name)]`, oldest record first
+    """
+    refs = []
+    if doctype == "Opportunity":
+        opportunity_from, party_name = frappe.db.get_value(
+            doctype, name, ["opportunity_from", "party_name"]
+        ) or (None, None)
+        if opportunity_from == "Lead" and party_name:
+            refs.append(frappe._dict(doctype="Lead", name=party_name))
+    refs.append(frappe._dict(doctype=doctype, name=name))
+    return refs
+
+
+def get_activity_records(doctype, name):
+    """
+    Return the records whose activities are shown for a Lead or Opportunity
+
+    An Opportunity converted from a Lead also shows the activities of the
+    Lead, without communications about events.
+
+    :return: `[_dict(doctype, name, creation, owner, creation_text, get_events)]`, oldest record first
+    """
+    if doctype == "Lead":
+        doc = frappe.db.get_value(doctype, name, ["creation", "owner"], as_dict=True)
+        if not doc:
+            frappe.throw(_("Document not found"), frappe.DoesNotExistError)
+        return [
+            frappe._dict(
+                doctype="Lead",
+                name=name,
+                creation=doc.creation,
+                owner=doc.owner,
+                creation_text="created this lead",
+                get_events=True,
+            )
+        ]
+
+    doc = frappe.db.get_value(
+        doctype,
+        name,
+        ["creation", "owner", "opportunity_from", "party_name"],
+        as_dict=True,
+    )
+    if not doc:
+        frappe.throw(_("Document not found"), frappe.DoesNotExistError)
+
+    records = []
+    creation_text = "created this opportunity"
+    if doc.opportunity_from == "Lead" and doc.party_name:
+        lead = frappe.db.get_value(
+            "Lead", doc.party_name, ["creation", "owner"], as_dict=True
+        )
+        if lead:
+            records.append(
+                frappe._dict(
+                    doctype="Lead",
+                    name=doc.party_name,
+                    creation=lead.creation,
+                    owner=lead.owner,
+                    creation_text="created this lead",
+                    get_events=False,
+                )
+            )
+            creation_text = "converted the lead to this opportunity"
+
+    records.append(
+        frappe._dict(
+            doctype=doctype,
+            name=name,
+            creation=doc.creation,
+            owner=doc.owner,
+            creation_text=creation_text,
+            get_events=True,
+        )
     )
+    return records
 
-    docinfo.versions.reverse()
 
-    for version in docinfo.versions:
-        data = json.loads(version.data)
-        if not data.get("changed"):
-            continue
+def get_activity_tab_etag(tab, records, *params):
+    """
+    ETag of a tab, derived from the number of rows and the latest `modified`
+    of every table the tab is built from
 
-        if change := data.get("changed")[0]:
-            field = opportunity_fields.get(change[0], None)
+    Counting as well catches deleted rows, which do not move `modified`.
+    Only aggregates are read, so it is cheap to compute before the tab is.
 
-            if (
-                not field
-                or change[0] in avoid_fields
-                or (not change[1] and not change[2])
-            ):
-                continue
+    :param records: Records whose activities are shown, as returned by `get_activity_record_refs`
+    :param params: Request parameters that change what the tab returns
+    """
+    versions = [frappe.session.user, tab, params]
+    for source, filters in ACTIVITY_TABS[tab]["sources"](records):
+        if isinstance(filters, dict):
+            row = frappe.get_all(
+                source,
+                filters=filters,
+                fields=["count(name) as count", "max(modified) as modified"],
+                order_by=None,
+            )[0]
+            versions.append((source, row.count, row.modified))
+        else:
+            # a query selecting the count and latest modified of rows reached through a join
+            versions.append((source, *filters.run()[0]))
+    return hashlib.md5(
+        json.dumps(versions, default=str).encode(), usedforsecurity=False
+    ).hexdigest()
 
-            field_label = field.get("label") or change[0]
-            field_option = field.get("options") or None
 
-            activity_type = "changed"
-            data = {
-                "field": change[0],
-                "field_label": field_label,
-                "old_value": change[1],
-                "value": change[2],
+def load_activities_tab(records, with_content=True, limit=None, before=None):
+    """
+    Build the activities tab, newest first
+
+    :param limit: Only return the newest `limit` activities, and any older ones created at the same moment as the last
+    :param before: Only return activities created before this
+    """
+    activities = []
+    for record in records:
+        activities.append(
+            {
+                "activity_type": "creation",
+                "creation": record.creation,
+                "owner": record.owner,
+                "data": record.creation_text,
+                "is_lead": record.doctype == "Lead",
             }
+        )
+        activities += get_record_activities(
+            record.doctype,
+            record.name,
+            record.get_events,
+            with_content,
+            limit=limit,
+            before=before,
+        )
+        activities += get_gmail_thread_activities(record.doctype, record.name)
 
-            if not change[1] and change[2]:
-                activity_type = "added"
-                data = {
-                    "field": change[0],
-                    "field_label": field_label,
-                    "value": change[2],
-                }
-            elif change[1] and not change[2]:
-                activity_type = "removed"
-                data = {
-                    "field": change[0],
-                    "field_label": field_label,
-                    "value": change[1],
-                }
-
-        activity = {
-            "activity_type": activity_type,
-            "creation": version.creation,
-            "owner": version.owner,
-            "data": data,
-            "is_lead": False,
-            "options": field_option,
-        }
-        activities.append(activity)
+    activities.sort(key=lambda x: get_datetime(x["creation"]), reverse=True)
+    if before:
+        activities = [a for a in activities if get_datetime(a["creation"]) < before]
+    if limit:
+        activities = limit_activities(activities, limit)
+    set_communication_previews(activities, with_content)
+    return handle_multiple_versions(activities)
 
-    for comment in docinfo.comments:
-        activity = {
-            "name": comment.name,
-            "activity_type": "comment",
-            "creation": comment.creation,
-            "owner": comment.owner,
-            "content": comment.content,
-            "attachments": get_attachments("Comment", comment.name),
-            "is_lead": False,
-        }
-        activities.append(activity)
 
-    for info_log in docinfo.info_logs:
-        activity = {
-            "name": info_log.name,
-            "activity_type": "comment",
-            "creation": info_log.creation,
-            "owner": info_log.owner,
-            "content": info_log.content,
-            "attachments": get_attachments("Comment", info_log.name),
-            "is_lead": False,
-        }
-        activities.append(activity)
+def limit_activities(activities, limit):
+    """
+    Keep the first `limit` of `activities` sorted newest first, plus those
+    created at the same moment as the last one kept
 
-    for communication in docinfo.communications + docinfo.automated_messages:
-        activity = {
-            "name": communication.name,  
-            "activity_type": "communication",
-            "communication_type": communication.communication_type,
-            "creation": communication.creation,
-            "data": {
-                "subject": communication.subject,
-                "content": communication.content,
-                "sender_full_name": communication.sender_full_name,
-                "sender": communication.sender,
-                "recipients": communication.recipients,
-                "cc": communication.cc,
-                "bcc": communication.bcc,
-                "attachments": get_attachments("Communication", communication.name),
-                "read_by_recipient": communication.read_by_recipient,
-                "delivery_status": communication.delivery_status,
-                "reference_doctype": communication.reference_doctype
-            },
-            "is_lead": False,
-        }
-        activities.append(activity)
+    Activities of one Version share their `creation`, so a page never ends
+    in the middle of them and `before` can seek past all of them.
+    """
+    if len(activities) <= limit:
+        return activities
+    last_creation = get_datetime(activities[limit - 1]["creation"])
+    end = limit
+    while end < len(activities) and get_datetime(activities[end]["creation"]) == last_creation:
+        end += 1
+    return activities[:end]
 
-    if "frappe_gmail_thread" in frappe.get_installed_apps():
-        from frappe_gmail_thread.api.activity import get_linked_gmail_threads
 
-        threads = get_linked_gmail_threads("Opportunity", name)
+def load_notes_tab(records):
+    notes = get_linked_notes(records[-1].name)
+    notes.sort(key=lambda x: x["added_on"], reverse=True)
+    return notes
 
-        for thread in threads:
-            activity = {
-                "name": doc_data["name"],
-                "activity_type": "communication",
-                "communication_type": "Email",
-                "creation": thread["template_data"]["doc"]["creation"],
-                "data": {
-                    "subject": thread["template_data"]["doc"]["subject"],
-                    "content": thread["template_data"]["doc"]["content"],
-                    "sender_full_name": thread["template_data"]["doc"][
-                        "sender_full_name"
-                    ],
-                    "sender": thread["template_data"]["doc"]["sender"],
-                    "recipients": thread["template_data"]["doc"]["recipients"],
-                    "cc": thread["template_data"]["doc"]["cc"],
-                    "bcc": thread["template_data"]["doc"]["bcc"],
-                    "attachments": thread["template_data"]["doc"]["attachments"],
-                    "read_by_recipient": thread["template_data"]["doc"][
-                        "read_by_recipient"
-                    ],
-                    "delivery_status": thread["template_data"]["doc"][
-                        "delivery_status"
-                    ],
-                },
-                "is_lead": False,
-            }
-            activities.append(activity)
 
-    for attachment_log in docinfo.attachment_logs:
-        activity = {
-            "name": attachment_log.name,
-            "activity_type": "attachment_log",
-            "creation": attachment_log.creation,
-            "owner": attachment_log.owner,
-            "data": parse_attachment_log(
-                attachment_log.content, attachment_log.comment_type
+def load_events_tab(records):
+    events = [event for record in records for event in get_linked_events(record.name)]
+    return list({e["name"]: e for e in events}.values())
+
+
+def get_activities_tab_sources(records):
+    sources = []
+    for record in records:
+        sources += [
+            ("Version", {"ref_doctype": record.doctype, "docname": record.name}),
+            (
+                "Comment",
+                {"reference_doctype": record.doctype, "reference_name": record.name},
             ),
-            "is_lead": False,
-        }
-        activities.append(activity)
+            (
+                "Communication",
+                {"reference_doctype": record.doctype, "reference_name": record.name},
+            ),
+        ]
+
+    # attachments of comments and communications are part of the activities
+    File = frappe.qb.DocType("File")
+    for source in ("Comment", "Communication"):
+        Source = frappe.qb.DocType(source)
+        sources.append(
+            (
+                f"File:{source}",
+                frappe.qb.from_(File)
+                .join(Source)
+                .on((File.attached_to_doctype == source) & (File.attached_to_name == Source.name))
+                .select(Count(File.name), Max(File.modified))
+                .where(Source.reference_doctype.isin([r.doctype for r in records]))
+                .where(Source.reference_name.isin([r.name for r in records])),
+            )
+        )
+    return sources
+
+
+def get_todos_tab_sources(records):
+    """ToDos show the calendar details of their linked Event, which can be edited on its own"""
+    sources = [("ToDo", {"reference_name": get_names(records)})]
+    if frappe.get_meta("ToDo").has_field("custom_linked_event"):
+        Event = frappe.qb.DocType("Event")
+        ToDo = frappe.qb.DocType("ToDo")
+        sources.append(
+            (
+                "Event:ToDo",
+                frappe.qb.from_(Event)
+                .join(ToDo)
+                .on(ToDo.custom_linked_event == Event.name)
+                .select(Count(Event.name), Max(Event.modified))
+                .where(ToDo.reference_name.isin([r.name for r in records])),
+            )
+        )
+    return sources
+
+
+def get_events_tab_sources(records):
+    """Participants tell which events are linked, the events themselves can be edited too"""
+    Event = frappe.qb.DocType("Event")
+    Participant = frappe.qb.DocType("Event Participants")
+    return [
+        ("Event Participants", {"reference_docname": get_names(records)}),
+        (
+            "Event",
+            frappe.qb.from_(Event)
+            .join(Participant)
+            .on((Participant.parent == Event.name) & (Participant.parenttype == "Event"))
+            .select(Count(Event.name), Max(Event.modified))
+            .where(Participant.reference_docname.isin([r.name for r in records])),
+        ),
+    ]
 
-    calls = calls + get_linked_calls(name)
-    notes = get_linked_notes(name)
-    todos = todos + get_linked_todos(name)
-    events = events + get_linked_events(name)
-    attachments = attachments + get_attachments("Opportunity", name)
-    
-    
-    events = list({e["name"]: e for e in events}.values())
-
-    activities.sort(key=lambda x: x["creation"], reverse=True)
-    activities = handle_multiple_versions(activities)
-    notes.sort(key=lambda x: x["added_on"], reverse=True)
-   
-    return activities, calls, notes, todos, events, attachments
 
+def get_attachments_tab_sources(records):
+    return [
+        (
+            "File",
+            {"attached_to_doctype": record.doctype, "attached_to_name": record.name},
+        )
+        for record in records
+    ]
 
-def get_lead_activities(name, get_events=True):
-    get_docinfo("", "Lead", name)
-    docinfo = frappe.response["docinfo"]
-    lead_meta = frappe.get_meta("Lead")
-    lead_fields = {
-        field.fieldname: {"label": field.label, "options": field.options}
-        for field in lead_meta.fields
-    }
-    avoid_fields = [
-        "converted",
-        "response_by",
-        "sla_creation",
-        "sla",
-        "first_response_time",
-        "first_responded_on",
+
+def get_names(records):
+    return ["in", [record.name for record in records]]
+
+
+# the order of the tabs is the order of get_activities' return value
+ACTIVITY_TABS = {
+    "activities": {
+        "load": load_activities_tab,
+        "sources": get_activities_tab_sources,
+    },
+    "calls": {
+        "load": lambda records: [
+            call for record in records for call in get_linked_calls(record.name)
+        ],
+        "sources": lambda records: [
+            ("CRM Call Log", {"reference_docname": get_names(records)})
+        ],
+    },
+    "notes": {
+        "load": load_notes_tab,
+        "sources": lambda records: [("CRM Note", {"parent": records[-1].name})],
+    },
+    "todos": {
+        "load": lambda records: [
+            todo for record in records for todo in get_linked_todos(record.name)
+        ],
+        "sources": get_todos_tab_sources,
+    },
+    "events": {
+        "load": load_events_tab,
+        "sources": get_events_tab_sources,
+    },
+    "attachments": {
+        "load": lambda records: [
+            attachment
+            for record in records
+            for attachment in get_attachments(record.doctype, record.name)
+        ],
+        "sources": get_attachments_tab_sources,
+    },
+}
+
+
+@frappe.whitelist()
+def get_timeline(doctype, name, page_length=20, cursor=None):
+    """
+    Fetch one page of the activity timeline of a Lead or Opportunity, newest first
+
+    Every source (versions, comments, communications, ...) is read lazily in
+    `creation desc` order and the sources are merged with a k-way merge, so
+    a page only reads about `page_length` rows per source however long the
+    timeline is. Opportunities converted from a Lead include the timeline
+    of that Lead.
+
+    :param page_length: Number of activities to return
+    :param cursor: Cursor returned with the previous page, `None` for the newest page
+    :return: `{"data": activities, "next_cursor": cursor}`, `next_cursor` is `None` on the last page
+
+    Emails come with a plain-text `preview` and `content_size` instead of
+    their body, which is fetched with `get_communication_body` on expand.
+    """
+    if doctype not in AVOID_FIELDS:
+        frappe.throw(_("Timeline is not available for {0}").format(_(doctype)))
+    frappe.has_permission(doctype, "read", name, throw=True)
+
+    page_length = cint(page_length) or 20
+    before = get_timeline_cursor_key(cursor) if cursor else None
+
+    sources = get_timeline_sources(doctype, name)
+    iterables = [
+        iter_timeline_source(source, rank, before, page_length + 1)
+        for rank, source in enumerate(sources)
     ]
+    merged = heapq.merge(*iterables, key=lambda entry: entry[0], reverse=True)
+    entries = list(islice(merged, page_length + 1))
+
+    next_cursor = None
+    if len(entries) > page_length:
+        entries = entries[:page_length]
+        next_cursor = encode_cursor(TIMELINE_ORDER, list(entries[-1][0]), 0)
+
+    activities = [activity for _key, activity in entries]
+    set_activity_attachments(activities)
+    set_communication_previews(activities, with_content=False)
+    return {
+        "data": handle_multiple_versions(activities) if activities else [],
+        "next_cursor": next_cursor,
+    }
+
+
+def get_timeline_cursor_key(cursor):
+    """
+    Return the key of the last activity of the previous page
+
+    Cursors from before activities were keyed by their position within a
+    row hold `(creation, rank, name)`, those continue after the whole row.
+    """
+    values = decode_cursor(cursor, TIMELINE_ORDER)["values"] or []
+    if len(values) == 3:
+        values = [*values, float("-inf")]
+    if len(values) != 4:
+        frappe.throw(_("Invalid cursor"), frappe.ValidationError)
+    return (get_datetime(values[0]), cint(values[1]), values[2], values[3])
+
+
+def get_timeline_sources(doctype, name):
+    """
+    Return the sources of the timeline of a record, each as a dict with
+
+    - `doctype`, `filters` and `fields` to read rows with, or `rows` for sources computed in Python
+    - `get_activity(row)` turning a row into an activity, or `None` to skip the row
+    """
+    sources = []
+    for record in get_activity_records(doctype, name):
+        sources += get_record_timeline_sources(
+            record.doctype, record, record.creation_text, record.get_events
+        )
+    return sources
+
+
+def get_record_timeline_sources(doctype, doc, creation_text, get_events=True):
+    is_lead = doctype == "Lead"
+    avoid_fields = AVOID_FIELDS[doctype]
+
+    comment_types = ["Comment", "Attachment", "Attachment Removed"]
+    if not is_lead:
+        comment_types += ["Info", "Edit", "Label"]
+
+    communication_filters = {
+        "reference_doctype": doctype,
+        "reference_name": doc.name,
+        "communication_type": ["in", ["Communication", "Automated Message"]],
+    }
+    if not get_events:
+        communication_filters["communication_medium"] = ["!=", "Event"]
 
-    doc = frappe.db.get_values("Lead", name, ["creation", "owner"])[0]
-    activities = [
+    sources = [
         {
-            "activity_type": "creation",
-            "creation": doc[0],
-            "owner": doc[1],
-            "data": "created this lead",
-            "is_lead": True,
-        }
+            "rows": [
+                frappe._dict(
+                    name=doc.name,
+                    creation=get_datetime(doc.creation),
+                    owner=doc.owner,
+                )
+            ],
+            "get_activity": lambda row: {
+                "activity_type": "creation",
+                "creation": row.creation,
+                "owner": row.owner,
+                "data": creation_text,
+                "is_lead": is_lead,
+            },
+        },
+        {
+            "doctype": "Version",
+            "filters": {"ref_doctype": doctype, "docname": doc.name},
+            "fields": ["name", "creation", "owner", "data"],
+            "get_activity": lambda row: get_version_activities(
+                row, doctype, avoid_fields, is_lead
+            ),
+        },
+        {
+            "doctype": "Comment",
+            "filters": {
+                "reference_doctype": doctype,
+                "reference_name": doc.name,
+                "comment_type": ["in", comment_types],
+            },
+            "fields": ["name", "creation", "owner", "content", "comment_type"],
+            "get_activity": lambda row: get_comment_activity(row, is_lead),
+        },
+        {
+            "doctype": "Communication",
+            "filters": communication_filters,
+            "fields": LAZY_COMMUNICATION_FIELDS,
+            "get_activity": lambda row: get_communication_activity(row, is_lead),
+        },
     ]
 
-    docinfo.versions.reverse()
+    if "frappe_gmail_thread" in frappe.get_installed_apps():
+        from frappe_gmail_thread.api.activity import get_linked_gmail_threads
 
-    for version in docinfo.versions:
-        data = json.loads(version.data)
-        if not data.get("changed"):
-            continue
+        threads = [
+            frappe._dict(thread["template_data"]["doc"])
+            for thread in get_linked_gmail_threads(doctype, doc.name)
+        ]
+        for thread in threads:
+            thread.creation = get_datetime(thread.creation)
+            thread.communication_type = "Email"
+        sources.append(
+            {
+                "rows": sorted(
+                    threads,
+                    key=lambda row: (row.creation, row.name or ""),
+                    reverse=True,
+                ),
+                "get_activity": lambda row: get_communication_activity(
+                    row, is_lead, is_gmail_thread=True
+                ),
+            }
+        )
+
+    return sources
+
+
+def iter_timeline_source(source, rank, before=None, chunk_size=21):
+    """
+    Yield `(key, activity)` of a timeline source in `creation desc` order,
+    starting after the `before` key
+
+    Rows are read `chunk_size` at a time, so only as many rows are read as
+    the merge actually consumes. The key `(creation, rank, name, index)`
+    orders activities created at the same moment by source, name and
+    position within the row (a Version gives one activity per changed field)
+    so that the cursor never skips or repeats them.
 
-        if change := data.get("changed")[0]:
-            field = lead_fields.get(change[0], None)
+    `get_activity` of the source may return one activity, a list of them or `None`.
+    """
+    if "rows" in source:
+        rows = iter(source["rows"])
+    else:
+        rows = iter_source_rows(source, before, chunk_size)
 
-            if (
-                not field
-                or change[0] in avoid_fields
-                or (not change[1] and not change[2])
-            ):
+    for row in rows:
+        creation = get_datetime(row.creation)
+        if before and (creation, rank, row.name or "") > before[:3]:
+            continue
+
+        activities = source["get_activity"](row) or []
+        if isinstance(activities, dict):
+            activities = [activities]
+        for index, activity in enumerate(activities):
+            # negated so that the activities of a row keep their order in a descending merge
+            key = (creation, rank, row.name or "", -index)
+            if before and key >= before:
                 continue
+            yield key, activity
 
-            field_label = field.get("label") or change[0]
-            field_option = field.get("options") or None
 
-            activity_type = "changed"
-            data = {
-                "field": change[0],
-                "field_label": field_label,
-                "old_value": change[1],
-                "value": change[2],
-            }
+def iter_source_rows(source, before=None, chunk_size=21):
+    """
+    Yield the rows of a timeline source in `(creation, name)` descending order
 
-            if not change[1] and change[2]:
-                activity_type = "added"
-                data = {
-                    "field": change[0],
-                    "field_label": field_label,
-                    "value": change[2],
-                }
-            elif change[1] and not change[2]:
-                activity_type = "removed"
-                data = {
-                    "field": change[0],
-                    "field_label": field_label,
-                    "value": change[1],
-                }
-
-        activity = {
-            "activity_type": activity_type,
-            "creation": version.creation,
-            "owner": version.owner,
-            "data": data,
-            "is_lead": True,
-            "options": field_option,
-        }
-        activities.append(activity)
+    Each chunk seeks from the last row of the previous one: rows up to its
+    `creation`, minus the rows already read at exactly that `creation`, so
+    reading deep into a timeline costs the same as reading its start.
+    """
+    filters = [
+        [source["doctype"], fieldname, *(value if isinstance(value, list) else ["=", value])]
+        for fieldname, value in source["filters"].items()
+    ]
+    last_creation = before[0] if before else None
+    seen_at_last_creation = []
+
+    while True:
+        seek = []
+        if last_creation is not None:
+            seek.append([source["doctype"], "creation", "<=", last_creation])
+        if seen_at_last_creation:
+            seek.append([source["doctype"], "name", "not in", seen_at_last_creation])
+
+        rows = frappe.get_all(
+            source["doctype"],
+            filters=filters + seek,
+            fields=source["fields"],
+            order_by="creation desc, name desc",
+            page_length=chunk_size,
+        )
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+
+        creation = rows[-1].creation
+        if creation != last_creation:
+            last_creation = creation
+            seen_at_last_creation = []
+        seen_at_last_creation += [row.name for row in rows if row.creation == creation]
+
+
+def set_activity_attachments(activities):
+    """Fill in the attachments of the comments and communications in `activities` with one query per doctype"""
+    comments = [a for a in activities if a["activity_type"] == "comment"]
+    communications = [
+        a
+        for a in activities
+        if a["activity_type"] == "communication"
+        and a.get("name")
+        and a["data"]["attachments"] == []
+    ]
+
+    comment_attachments = get_attachments_map("Comment", [a["name"] for a in comments])
+    for activity in comments:
+        activity["attachments"] = comment_attachments[activity["name"]]
+
+    communication_attachments = get_attachments_map(
+        "Communication", [a["name"] for a in communications]
+    )
+    for activity in communications:
+        activity["data"]["attachments"] = communication_attachments[activity["name"]]
 
-    for comment in docinfo.comments:
-        activity = {
+
+def get_comment_activity(comment, is_lead):
+    if comment.comment_type in ("Attachment", "Attachment Removed"):
+        return {
             "name": comment.name,
-            "activity_type": "comment",
+            "activity_type": "attachment_log",
             "creation": comment.creation,
             "owner": comment.owner,
-            "content": comment.content,
-            "attachments": get_attachments("Comment", comment.name),
-            "is_lead": True,
+            "data": parse_attachment_log(comment.content, comment.comment_type),
+            "is_lead": is_lead,
         }
+
+    return {
+        "name": comment.name,
+        "activity_type": "comment",
+        "creation": comment.creation,
+        "owner": comment.owner,
+        "content": comment.content,
+        "attachments": [],
+        "is_lead": is_lead,
+    }
+
+
+def get_communication_activity(communication, is_lead, is_gmail_thread=False):
+    """
+    Turn a Communication, or a Gmail thread, into a timeline activity
+
+    Gmail threads carry their own attachments and body and are not
+    Communications, so they are left without a `name` for attachments and
+    previews to skip them.
+    """
+    activity = {
+        "activity_type": "communication",
+        "communication_type": communication.communication_type,
+        "creation": communication.creation,
+        "data": {
+            "subject": communication.subject,
+            "content": communication.content,
+            "sender_full_name": communication.sender_full_name,
+            "sender": communication.sender,
+            "recipients": communication.recipients,
+            "cc": communication.cc,
+            "bcc": communication.bcc,
+            # filled in for the whole page by set_activity_attachments
+            "attachments": communication.attachments if is_gmail_thread else [],
+            "read_by_recipient": communication.read_by_recipient,
+            "delivery_status": communication.delivery_status,
+            "reference_doctype": communication.reference_doctype,
+        },
+        "is_lead": is_lead,
+    }
+    if not is_gmail_thread:
+        activity["name"] = communication.name
+    return activity
+
+
+def set_communication_previews(activities, with_content=True):
+    """
+    Set the plain-text `preview` and `content_size` of the emails in `activities`
+
+    :param with_content: Keep the full body in `content`, otherwise it is set to `None`
+    """
+    communications = [
+        a for a in activities if a["activity_type"] == "communication" and a.get("name")
+    ]
+    previews = get_communication_previews(
+        {a["name"]: a["data"]["content"] for a in communications}
+    )
+    for activity in communications:
+        activity["data"].update(
+            previews.get(activity["name"]) or {"preview": "", "content_size": 0}
+        )
+        if not with_content:
+            activity["data"]["content"] = None
+
+
+def get_record_activities(
+    doctype, name, get_events=True, with_content=True, limit=None, before=None
+):
+    """
+    Return the version, comment, communication and attachment log activities
+    of a Lead or Opportunity
+
+    They are read from the CRM Activity feed once it has been built, and
+    rebuilt from the docinfo otherwise.
+
+    :param get_events: Include communications about events
+    :param with_content: Read the body of emails, previews are used otherwise
+    :param limit: Read only about the newest `limit` entries of the feed, see `get_feed_activities`
+    :param before: Read only feed entries created before this
+    """
+    from next_crm.ncrm.doctype.crm_activity.crm_activity import (
+        is_activity_feed_built,
+    )
+
+    if is_activity_feed_built():
+        frappe.has_permission(doctype, "read", name, throw=True)
+        return get_feed_activities(
+            doctype, name, get_events, with_content, limit=limit, before=before
+        )
+    return get_docinfo_activities(doctype, name, get_events)
+
+
+def get_feed_activities(
+    doctype, name, get_events=True, with_content=True, limit=None, before=None
+):
+    """
+    Read activities from the CRM Activity feed, newest first
+
+    Entries are read through the `(reference_doctype, reference_name,
+    creation)` index. With `limit`, the newest `limit` entries are read,
+    plus any others created at the same moment as the last of them, so a
+    Version's changes are never split across pages.
+
+    :param before: Only read entries created before this
+    """
+    is_lead = doctype == "Lead"
+    activity_types = ["version", "comment", "attachment_log", "communication"]
+    if not is_lead:
+        activity_types.append("info_log")
+    if get_events:
+        activity_types.append("event_communication")
+
+    filters = {
+        "reference_doctype": doctype,
+        "reference_name": name,
+        "activity_type": ["in", activity_types],
+    }
+    if before:
+        filters["creation"] = ["<", before]
+    fields = ["name", "activity_type", "source_name", "owner", "creation", "data"]
+
+    entries = frappe.get_all(
+        "CRM Activity",
+        filters=filters,
+        fields=fields,
+        order_by="creation desc",
+        page_length=cint(limit),
+    )
+    if limit and len(entries) == cint(limit):
+        last_creation = entries[-1].creation
+        entries += frappe.get_all(
+            "CRM Activity",
+            filters={
+                **filters,
+                "creation": last_creation,
+                "name": ["not in", [e.name for e in entries if e.creation == last_creation]],
+            },
+            fields=fields,
+            order_by=None,
+        )
+
+    communication_names = [
+        entry.source_name
+        for entry in entries
+        if entry.activity_type in ("communication", "event_communication")
+    ]
+    communications = {}
+    if communication_names:
+        communications = {
+            communication.name: communication
+            for communication in frappe.get_all(
+                "Communication",
+                filters={"name": ["in", communication_names]},
+                fields=(
+                    COMMUNICATION_ACTIVITY_FIELDS
+                    if with_content
+                    else LAZY_COMMUNICATION_FIELDS
+                ),
+            )
+        }
+
+    activities = []
+    for entry in entries:
+        if entry.activity_type in ("communication", "event_communication"):
+            communication = communications.get(entry.source_name)
+            if communication:
+                activities.append(get_communication_activity(communication, is_lead))
+            continue
+
+        activity = json.loads(entry.data)
+        activity.update(creation=entry.creation, owner=entry.owner, is_lead=is_lead)
         activities.append(activity)
 
+    set_activity_attachments(activities)
+    return activities
+
+
+def get_docinfo_activities(doctype, name, get_events=True):
+    get_docinfo("", doctype, name)
+    docinfo = frappe.response["docinfo"]
+    is_lead = doctype == "Lead"
+    avoid_fields = AVOID_FIELDS[doctype]
+
+    activities = []
+    for version in reversed(docinfo.versions):
+        activities += get_version_activities(version, doctype, avoid_fields, is_lead)
+
+    comments = docinfo.comments + ([] if is_lead else docinfo.info_logs)
+    for comment in comments + docinfo.attachment_logs:
+        activities.append(get_comment_activity(comment, is_lead))
+
     for communication in docinfo.communications + docinfo.automated_messages:
         if communication.get("communication_medium") == "Event" and not get_events:
             continue
-        activity = {
-            "activity_type": "communication",
-            "communication_type": communication.communication_type,
-            "creation": communication.creation,
-            "data": {
-                "subject": communication.subject,
-                "content": communication.content,
-                "sender_full_name": communication.sender_full_name,
-                "sender": communication.sender,
-                "recipients": communication.recipients,
-                "cc": communication.cc,
-                "bcc": communication.bcc,
-                "attachments": get_attachments("Communication", communication.name),
-                "read_by_recipient": communication.read_by_recipient,
-                "delivery_status": communication.delivery_status,
-                "reference_doctype": communication.reference_doctype
-            },
-            "is_lead": True,
-        }
-        activities.append(activity)
+        activities.append(get_communication_activity(communication, is_lead))
 
-    if "frappe_gmail_thread" in frappe.get_installed_apps():
-        from frappe_gmail_thread.api.activity import get_linked_gmail_threads
+    set_activity_attachments(activities)
+    return activities
 
-        threads = get_linked_gmail_threads("Lead", name)
 
-        for thread in threads:
-            activity = {
-                "activity_type": "communication",
-                "communication_type": "Email",
-                "creation": thread["template_data"]["doc"]["creation"],
-                "data": {
-                    "subject": thread["template_data"]["doc"]["subject"],
-                    "content": thread["template_data"]["doc"]["content"],
-                    "sender_full_name": thread["template_data"]["doc"][
-                        "sender_full_name"
-                    ],
-                    "sender": thread["template_data"]["doc"]["sender"],
-                    "recipients": thread["template_data"]["doc"]["recipients"],
-                    "cc": thread["template_data"]["doc"]["cc"],
-                    "bcc": thread["template_data"]["doc"]["bcc"],
-                    "attachments": thread["template_data"]["doc"]["attachments"],
-                    "read_by_recipient": thread["template_data"]["doc"][
-                        "read_by_recipient"
-                    ],
-                    "delivery_status": thread["template_data"]["doc"][
-                        "delivery_status"
-                    ],
-                },
-                "is_lead": True,
-            }
-            activities.append(activity)
+def get_gmail_thread_activities(doctype, name):
+    if "frappe_gmail_thread" not in frappe.get_installed_apps():
+        return []
 
-    for attachment_log in docinfo.attachment_logs:
-        activity = {
-            "name": attachment_log.name,
-            "activity_type": "attachment_log",
-            "creation": attachment_log.creation,
-            "owner": attachment_log.owner,
-            "data": parse_attachment_log(
-                attachment_log.content, attachment_log.comment_type
-            ),
-            "is_lead": True,
-        }
-        activities.append(activity)
+    from frappe_gmail_thread.api.activity import get_linked_gmail_threads
 
-    calls = get_linked_calls(name)
-    notes = get_linked_notes(name)
-    todos = get_linked_todos(name)
-    events = get_linked_events(name)
-    attachments = get_attachments("Lead", name)
+    activities = []
+    for thread in get_linked_gmail_threads(doctype, name):
+        thread = frappe._dict(thread["template_data"]["doc"])
+        thread.communication_type = "Email"
+        activities.append(
+            get_communication_activity(thread, doctype == "Lead", is_gmail_thread=True)
+        )
+    return activities
 
-    activities.sort(key=lambda x: x["creation"], reverse=True)
-    activities = handle_multiple_versions(activities)
-    notes.sort(key=lambda x: x["added_on"], reverse=True)
-    
-    return activities, calls, notes, todos, events, attachments
+
+ATTACHMENT_FIELDS = [
+    "name",
+    "file_name",
+    "file_type",
+    "file_url",
+    "file_size",
+    "is_private",
+    "creation",
+    "owner",
+]
 
 
 def get_attachments(doctype, name):
@@ -405,21 +934,37 @@ def get_attachments(doctype, name):
         frappe.db.get_all(
             "File",
             filters={"attached_to_doctype": doctype, "attached_to_name": name},
-            fields=[
-                "name",
-                "file_name",
-                "file_type",
-                "file_url",
-                "file_size",
-                "is_private",
-                "creation",
-                "owner",
-            ],
+            fields=ATTACHMENT_FIELDS,
         )
         or []
     )
 
 
+def get_attachments_map(doctype, names):
+    """
+    Fetch the attachments of many documents of `doctype` in one query
+
+    :return: `{name: [attachments]}` with an entry for every name in `names`
+    """
+    attachments = {name: [] for name in names}
+    if not attachments:
+        return attachments
+
+    files = frappe.db.get_all(
+        "File",
+        filters={
+            "attached_to_doctype": doctype,
+            "attached_to_name": ["in", list(attachments)],
+        },
+        fields=[*ATTACHMENT_FIELDS, "attached_to_name"],
+    )
+    for file in files:
+        attached_to_name = file.pop("attached_to_name")
+        if attached_to_name in attachments:
+            attachments[attached_to_name].append(file)
+    return attachments
+
+
 def handle_multiple_versions(versions):
     activities = []
     grouped_versions = []
@@ -557,34 +1102,17 @@ def get_linked_todos(name):
         fields=fields,
     )
 
+    events = get_events_with_participants(
+        [todo["custom_linked_event"] for todo in todos if todo.get("custom_linked_event")],
+        ["name", "sync_with_google_calendar", "google_calendar"],
+    )
+
     for todo in todos:
         if todo.get("custom_linked_event", None):
-            event = frappe.db.get_value(
-                "Event",
-                todo["custom_linked_event"],
-                ["name", "sync_with_google_calendar", "google_calendar"],
-            )
+            event = events.get(todo["custom_linked_event"])
             if not event:
                 continue
-            todo["_event"] = {
-                "name": event[0],
-                "sync_with_google_calendar": event[1],
-                "google_calendar": event[2],
-            }
-            event_participants = frappe.db.get_all(
-                "Event Participants",
-                filters={"parent": todo["_event"]["name"]},
-                fields=["reference_doctype", "reference_docname", "email"],
-            )
-            event_participants = [
-                {
-                    "reference_doctype": participant["reference_doctype"],
-                    "reference_docname": participant["reference_docname"],
-                    "email": participant["email"],
-                }
-                for participant in event_participants
-            ]
-            todo["_event"]["event_participants"] = event_participants
+            todo["_event"] = event
         else:
             todo["_event"] = None
 
@@ -611,40 +1139,121 @@ def get_linked_events(name):
         ],
     )
 
-    for event in events:
-        event["event_participants"] = frappe.db.get_all(
-            "Event Participants",
-            filters={"parent": event.name},
-            fields=["reference_doctype", "reference_docname", "email"],
-        )
-
+    set_event_participants(events)
     return events or []
 
 
+def get_events_with_participants(names, fields):
+    """
+    Fetch many Events with their participants in two queries
+
+    :param names: Names of the events, missing events are left out
+    :param fields: Event fields to fetch, `name` is always fetched
+    :return: `{name: event}` with the participants under `event_participants`
+    """
+    names = list(set(names))
+    if not names:
+        return {}
+
+    events = frappe.db.get_all(
+        "Event",
+        filters={"name": ["in", names]},
+        fields=list(dict.fromkeys(["name", *fields])),
+    )
+    set_event_participants(events)
+    return {event.name: event for event in events}
+
+
+def set_event_participants(
+    events, fields=("reference_doctype", "reference_docname", "email")
+):
+    """Set `event_participants` of every event in `events` with one query"""
+    participants = {event["name"]: [] for event in events}
+    if not participants:
+        return
+
+    rows = frappe.db.get_all(
+        "Event Participants",
+        filters={"parenttype": "Event", "parent": ["in", list(participants)]},
+        fields=["parent", *fields],
+        order_by="idx asc",
+    )
+    for row in rows:
+        parent = row.pop("parent")
+        if parent in participants:
+            participants[parent].append(row)
+
+    for event in events:
+        event["event_participants"] = participants[event["name"]]
+
+
 def parse_attachment_log(html, type):
-    soup = BeautifulSoup(html, "html.parser")
-    a_tag = soup.find("a")
     type = "added" if type == "Attachment" else "removed"
-    if not a_tag:
+    anchor = parse_first_anchor(html or "")
+    if not anchor:
         return {
             "type": type,
-            "file_name": html.replace("Removed ", ""),
+            "file_name": (html or "").replace("Removed ", ""),
             "file_url": "",
             "is_private": False,
         }
 
-    is_private = False
-    if "private/files" in a_tag["href"]:
-        is_private = True
-
+    file_name, file_url = anchor
     return {
         "type": type,
-        "file_name": a_tag.text,
-        "file_url": a_tag["href"],
-        "is_private": is_private,
+        "file_name": file_name,
+        "file_url": file_url,
+        "is_private": "private/files" in file_url,
     }
 
 
+class StopParsing(Exception):
+    pass
+
+
+class FirstAnchorParser(HTMLParser):
+    """Collect the text and `href` of the first `<a>` tag and stop reading there"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.href = None
+        self.text = []
+        self.in_anchor = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a" and not self.in_anchor:
+            self.in_anchor = True
+            self.href = dict(attrs).get("href") or ""
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self.in_anchor:
+            raise StopParsing
+
+    def handle_data(self, data):
+        if self.in_anchor:
+            self.text.append(data)
+
+
+@lru_cache(maxsize=4096)
+def parse_first_anchor(html):
+    """
+    Return `(text, href)` of the first anchor in `html`, `None` if there is none
+
+    Attachment logs are short and repeat a lot (every file added to a
+    record is logged the same way), so results are memoized on the content.
+    """
+    parser = FirstAnchorParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except StopParsing:
+        pass
+
+    if not parser.in_anchor:
+        return None
+    return "".join(parser.text), parser.href
+
+
 @frappe.whitelist()
 def delete_attachment(filename, doctype=None, docname=None):
     """
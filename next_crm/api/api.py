@@ -3,6 +3,8 @@ import json
 import frappe
 from frappe import _
 
+from next_crm.api.activities import set_event_participants
+
 
 # File: next_crm/api/api.py
 
@@ -15,14 +17,7 @@ def get_all_events():
         limit=1000
     )
 
-    # Now fetch child table data manually
-    for e in events:
-        e["event_participants"] = frappe.get_all(
-            "Event Participants",
-            fields=["reference_doctype", "reference_docname"],
-            filters={"parent": e.name}
-        )
-
+    set_event_participants(events, ["reference_doctype", "reference_docname"])
     return events
 
 
@@ -0,0 +1,100 @@
+import json
+import re
+from html import unescape
+
+import frappe
+from frappe.utils import strip_html
+
+COMMUNICATION_PREVIEW_CACHE_KEY = "next_crm:communication_preview:"
+PREVIEW_CACHE_TTL = 7 * 24 * 60 * 60
+PREVIEW_LENGTH = 300
+
+NON_TEXT_ELEMENTS = re.compile(
+    r"<(style|script|head)\b[^>]*>.*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+
+
+@frappe.whitelist()
+def get_communication_body(name):
+    """Fetch the full HTML content of a Communication shown as a preview in the timeline"""
+    frappe.has_permission("Communication", "read", name, throw=True)
+    return frappe.db.get_value("Communication", name, "content")
+
+
+def make_communication_preview(content):
+    """
+    Return the plain-text preview of an email body and the size of the body
+
+    :return: `{"preview": str, "content_size": int}`, `content_size` in bytes
+    """
+    content = content or ""
+    text = unescape(strip_html(NON_TEXT_ELEMENTS.sub(" ", content)))
+    text = " ".join(text.split())
+    if len(text) > PREVIEW_LENGTH:
+        text = text[:PREVIEW_LENGTH].rstrip() + "…"
+    return {"preview": text, "content_size": len(content.encode())}
+
+
+def get_communication_previews(contents):
+    """
+    Return the previews of many Communications
+
+    Previews are cached per communication for a week, and all the cached
+    ones a page needs are read with a single `MGET`.
+
+    :param contents: `{name: content}`, content may be `None` if it was not loaded
+    :return: `{name: {"preview": str, "content_size": int}}`, unknown communications are left out
+    """
+    previews = {}
+    unloaded = []
+    for name, content in contents.items():
+        if content is not None:
+            previews[name] = make_communication_preview(content)
+        else:
+            unloaded.append(name)
+
+    missing = []
+    if unloaded:
+        cached = frappe.cache.mget([get_preview_key(name) for name in unloaded])
+        for name, preview in zip(unloaded, cached, strict=True):
+            if preview:
+                previews[name] = json.loads(preview)
+            else:
+                missing.append(name)
+
+    if missing:
+        for communication in frappe.get_all(
+            "Communication",
+            filters={"name": ["in", missing]},
+            fields=["name", "content"],
+        ):
+            previews[communication.name] = cache_preview(
+                communication.name, communication.content
+            )
+
+    return previews
+
+
+def get_preview_key(name):
+    return frappe.cache.make_key(COMMUNICATION_PREVIEW_CACHE_KEY + name)
+
+
+def cache_preview(name, content):
+    preview = make_communication_preview(content)
+    frappe.cache.set(get_preview_key(name), json.dumps(preview), ex=PREVIEW_CACHE_TTL)
+    return preview
+
+
+def cache_communication_preview(name):
+    """Background job computing the preview of a new Communication"""
+    content = frappe.db.get_value("Communication", name, "content")
+    if content is not None:
+        cache_preview(name, content)
+
+
+def clear_communication_preview(name):
+    frappe.cache.delete(get_preview_key(name))
+
+
+def clear_communication_previews():
+    frappe.cache.delete_keys(COMMUNICATION_PREVIEW_CACHE_KEY)
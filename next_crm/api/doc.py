@@ -1,3 +1,4 @@
+import hashlib
 import json
 
 import frappe
@@ -5,10 +6,17 @@ from frappe import _
 from frappe.custom.doctype.property_setter.property_setter import make_property_setter
 from frappe.model import no_value_fields
 from frappe.model.document import get_controller
-from frappe.utils import make_filter_tuple
+from frappe.utils import cint, cstr, make_filter_tuple
 
+from next_crm.api.group_by import get_group_counts
+from next_crm.api.kanban import get_kanban_data
+from next_crm.api.pagination import get_cursor_page
 from next_crm.api.views import get_views
 from next_crm.ncrm.doctype.crm_form_script.crm_form_script import get_form_script
+from next_crm.ncrm.doctype.crm_list_row.crm_list_row import (
+    PROJECTED_COUNTS,
+    get_list_rows,
+)
 
 
 @frappe.whitelist()
@@ -254,6 +262,10 @@ def get_data(
     kanban_fields=None,
     view=None,
     default_filters=None,
+    with_activity_counts=False,
+    cursor=None,
+    cursor_pagination=False,
+    meta_version=None,
 ):
     custom_view = False
     filters = frappe._dict(filters)
@@ -295,6 +307,7 @@ def get_data(
 
     is_default = True
     data = []
+    next_cursor = None
     _list = get_controller(doctype)
     default_rows = []
     if hasattr(_list, "default_list_data"):
@@ -354,16 +367,35 @@ def get_data(
         if group_by_field and group_by_field not in rows:
             rows.append(group_by_field)
 
-        data = (
-            frappe.get_list(
-                doctype,
-                fields=rows,
-                filters=filters,
-                order_by=order_by,
-                page_length=page_length,
+        list_rows = None
+        if not cursor and not cint(cursor_pagination):
+            projected_rows = rows
+            if cint(with_activity_counts):
+                projected_rows = [*rows, *PROJECTED_COUNTS]
+            list_rows = get_list_rows(
+                doctype, projected_rows, filters, order_by, page_length
             )
-            or []
-        )
+
+        if list_rows is not None:
+            data = list_rows
+        elif cursor or cint(cursor_pagination):
+            data, next_cursor = get_cursor_page(
+                doctype, rows, filters, order_by, page_length, cursor
+            )
+        else:
+            data = (
+                frappe.get_list(
+                    doctype,
+                    fields=rows,
+                    filters=filters,
+                    order_by=order_by,
+                    page_length=page_length,
+                )
+                or []
+            )
+
+        if cint(with_activity_counts) and list_rows is None:
+            set_activity_counts(data, doctype)
 
     if view_type == "kanban":
         if not rows:
@@ -417,58 +449,44 @@ def get_data(
             cf_in_filter = False
             enabled_columns = kanban_columns
 
+        active_columns = [
+            kc
+            for kc in enabled_columns
+            if not (
+                (
+                    column_field in filters
+                    and filters.get(column_field) != kc.get("name")
+                    and not cf_in_filter
+                )
+                or kc.get("delete")
+            )
+        ]
+        active_column_names = {kc.get("name") for kc in active_columns}
+
+        column_cards, column_counts = {}, {}
+        if active_columns:
+            if cf_in_filter:
+                filters.pop(column_field, None)
+            if "custom_priority" not in rows:
+                rows.append("custom_priority")
+            column_cards, column_counts = get_kanban_data(
+                doctype, filters, column_field, active_columns, rows, order_by
+            )
+
         for kc in enabled_columns:
-            column_filters = {column_field: kc.get("name")}
             order = kc.get("order")
-
-            if (
-                column_field in filters
-                and filters.get(column_field) != kc.get("name")
-                and not cf_in_filter
-            ) or kc.get("delete"):
-                column_data = []
-            else:
-                if cf_in_filter:
-                    filters.pop(column_field, None)
-                column_filters.update(filters.copy())
-
-                page_length = 20
-
-                if kc.get("page_length"):
-                    page_length = kc.get("page_length")
-
-                if order:
-                    if "custom_priority" not in rows:
-                        rows.append("custom_priority")
-                    column_data = get_records_based_on_order(
-                        doctype, rows, column_filters, page_length, order
-                    )
-                else:
-                    if "custom_priority" not in rows:
-                        rows.append("custom_priority")
-                    column_data = frappe.get_list(
-                        doctype,
-                        fields=rows,
-                        filters=convert_filter_to_tuple(doctype, column_filters),
-                        order_by=order_by,
-                        page_length=page_length,
-                    )
-
-                new_filters = filters.copy()
-                new_filters.update({column_field: kc.get("name")})
-
-                all_count = len(
-                    frappe.get_list(
-                        doctype, filters=convert_filter_to_tuple(doctype, new_filters)
-                    )
+            column_data = []
+
+            if kc.get("name") in active_column_names:
+                column_data = column_cards.get(kc.get("name"), [])
+                all_count = column_counts.get(kc.get("name"))
+                kc["all_count"] = all_count.count if all_count else 0
+                kc["all_count_estimated"] = bool(all_count and all_count.is_estimated)
+                kc["all_count_lower_bound"] = bool(
+                    all_count and all_count.is_lower_bound
                 )
-
-                kc["all_count"] = all_count
                 kc["count"] = len(column_data)
 
-                for d in column_data:
-                    getCounts(d, doctype)
-
             if order:
                 column_data = sorted(
                     column_data,
@@ -481,40 +499,16 @@ def get_data(
 
             data.append({"column": kc, "fields": kanban_fields, "data": column_data})
 
-    fields = frappe.get_meta(doctype).fields
-    fields = [field for field in fields if field.fieldtype not in no_value_fields]
-    fields = [
-        {
-            "label": _(field.label),
-            "type": field.fieldtype,
-            "value": field.fieldname,
-            "options": field.options,
-        }
-        for field in fields
-        if field.label and field.fieldname
-    ]
+        set_activity_counts(
+            [d for column in data for d in column.get("data")], doctype
+        )
 
-    std_fields = [
-        {"label": "Name", "type": "Data", "value": "name"},
-        {"label": "Created On", "type": "Datetime", "value": "creation"},
-        {"label": "Last Modified", "type": "Datetime", "value": "modified"},
-        {
-            "label": "Modified By",
-            "type": "Link",
-            "value": "modified_by",
-            "options": "User",
-        },
-        {"label": "Assigned To", "type": "Text", "value": "_assign"},
-        {"label": "Owner", "type": "Link", "value": "owner", "options": "User"},
-        {"label": "Like", "type": "Data", "value": "_liked_by"},
-    ]
+    list_meta = get_list_meta(doctype, view_type)
+    fields = list_meta.fields
 
-    for field in std_fields:
+    for field in get_standard_list_fields():
         if field.get("value") not in rows:
             rows.append(field.get("value"))
-        if field not in fields:
-            field["label"] = _(field["label"])
-            fields.append(field)
 
     if not is_default and custom_view_name:
         is_default = frappe.db.get_value(
@@ -522,15 +516,14 @@ def get_data(
         )
 
     if group_by_field and view_type == "group_by":
+        group_counts = get_group_counts(doctype, filters, group_by_field)
 
         def get_options(type, options):
             if type == "Select":
                 return [option for option in options.split("\n")]
             else:
-                has_empty_values = any([not d.get(group_by_field) for d in data])
-                options = list({d.get(group_by_field) for d in data})
-                options = [u for u in options if u]
-                if has_empty_values:
+                options = [u for u in group_counts if u]
+                if "" in group_counts:
                     options.append("")
 
                 if order_by and group_by_field in order_by:
@@ -554,8 +547,13 @@ def get_data(
                     "name": field.get("value"),
                     "type": field.get("type"),
                     "options": get_options(field.get("type"), field.get("options")),
+                    "counts": {cstr(k): v for k, v in group_counts.items()},
                 }
 
+    total_count = get_count(
+        doctype, filters, estimate_threshold=get_count_estimate_threshold()
+    )
+
     # Explicitly adding "Link Type" to Link fields if empty
     field_map = {f["value"]: f for f in fields}
 
@@ -564,7 +562,7 @@ def get_data(
         if key in field_map:
             column["type"] = field_map[key]["type"]
 
-    return {
+    response = {
         "data": data,
         "columns": columns,
         "rows": rows,
@@ -577,14 +575,25 @@ def get_data(
         "page_length": page_length,
         "page_length_count": page_length_count,
         "is_default": is_default,
-        "views": get_views(doctype),
-        "total_count": len(frappe.get_list(doctype, filters=filters)),
+        "views": list_meta.views,
+        "total_count": total_count.count,
+        "total_count_estimated": total_count.is_estimated,
+        "total_count_lower_bound": total_count.is_lower_bound,
         "row_count": len(data),
-        "form_script": get_form_script(doctype),
-        "list_script": get_form_script(doctype, "List"),
+        "next_cursor": next_cursor,
+        "form_script": list_meta.form_script,
+        "list_script": list_meta.list_script,
         "view_type": view_type,
+        "meta_version": list_meta.version,
     }
 
+    # the client already has this metadata, skip sending it again
+    if meta_version and meta_version == list_meta.version:
+        for key in ("fields", "views", "form_script", "list_script"):
+            response.pop(key)
+
+    return response
+
 
 def convert_filter_to_tuple(doctype, filters):
     if isinstance(filters, dict):
@@ -595,33 +604,156 @@ def convert_filter_to_tuple(doctype, filters):
     return filters
 
 
-def get_records_based_on_order(doctype, rows, filters, page_length, order):
-    records = []
-    filters = convert_filter_to_tuple(doctype, filters)
-    in_filters = filters.copy()
-    in_filters.append([doctype, "name", "in", order[:page_length]])
-    records = frappe.get_list(
-        doctype,
-        fields=rows,
-        filters=in_filters,
-        order_by="creation desc",
-        page_length=page_length,
+LIST_META_CACHE_KEY = "next_crm:list_meta"
+
+# doctypes whose changes affect the list metadata -> field holding the affected doctype
+LIST_META_SOURCE_FIELDS = {
+    "DocType": "name",
+    "Custom Field": "dt",
+    "Property Setter": "doc_type",
+    "CRM Form Script": "dt",
+    "CRM View Settings": "dt",
+}
+
+
+def get_standard_list_fields():
+    return [
+        {"label": "Name", "type": "Data", "value": "name"},
+        {"label": "Created On", "type": "Datetime", "value": "creation"},
+        {"label": "Last Modified", "type": "Datetime", "value": "modified"},
+        {
+            "label": "Modified By",
+            "type": "Link",
+            "value": "modified_by",
+            "options": "User",
+        },
+        {"label": "Assigned To", "type": "Text", "value": "_assign"},
+        {"label": "Owner", "type": "Link", "value": "owner", "options": "User"},
+        {"label": "Like", "type": "Data", "value": "_liked_by"},
+    ]
+
+
+def get_list_meta(doctype, view_type=None):
+    """
+    Return the metadata `get_data` sends along with the records
+
+    Fields, views and form scripts only change when the DocType, its
+    customizations, form scripts or view settings change, so they are cached
+    per doctype, language, view type and user until one of those is updated.
+    `version` is a hash of the bundle the client can send back as
+    `meta_version` to skip downloading it again.
+    """
+    key = f"{doctype}:{frappe.local.lang}:{view_type or 'list'}:{frappe.session.user}"
+    if list_meta := frappe.cache.hget(LIST_META_CACHE_KEY, key):
+        return list_meta
+
+    fields = frappe.get_meta(doctype).fields
+    fields = [field for field in fields if field.fieldtype not in no_value_fields]
+    fields = [
+        {
+            "label": _(field.label),
+            "type": field.fieldtype,
+            "value": field.fieldname,
+            "options": field.options,
+        }
+        for field in fields
+        if field.label and field.fieldname
+    ]
+
+    for field in get_standard_list_fields():
+        if field not in fields:
+            field["label"] = _(field["label"])
+            fields.append(field)
+
+    list_meta = frappe._dict(
+        fields=fields,
+        views=get_views(doctype),
+        form_script=get_form_script(doctype),
+        list_script=get_form_script(doctype, "List"),
     )
+    list_meta.version = hashlib.md5(
+        frappe.as_json(list_meta).encode(), usedforsecurity=False
+    ).hexdigest()
+
+    frappe.cache.hset(LIST_META_CACHE_KEY, key, list_meta)
+    return list_meta
+
+
+def clear_list_meta_cache(doc=None, method=None):
+    """Drop the cached list metadata of the doctype `doc` affects, of every doctype without `doc`"""
+    source_field = LIST_META_SOURCE_FIELDS.get(doc.doctype) if doc else None
+    if not source_field or not doc.get(source_field):
+        frappe.cache.delete_value(LIST_META_CACHE_KEY)
+        return
+    clear_doctype_list_meta(doc.get(source_field))
+
+
+def clear_doctype_list_meta(doctype):
+    prefix = f"{doctype}:"
+    for key in frappe.cache.hkeys(LIST_META_CACHE_KEY):
+        key = frappe.safe_decode(key)
+        if key.startswith(prefix):
+            frappe.cache.hdel(LIST_META_CACHE_KEY, key)
+
 
-    if len(records) < page_length:
-        not_in_filters = filters.copy()
-        not_in_filters.append([doctype, "name", "not in", order])
-        remaining_records = frappe.get_list(
+def get_count_estimate_threshold():
+    """Row count above which list totals are reported as an estimate (0 disables)"""
+    return cint(
+        frappe.db.get_single_value(
+            "NCRM Settings", "count_estimate_threshold", cache=True
+        )
+    )
+
+
+def get_count(doctype, filters=None, estimate_threshold=0):
+    """
+    Count the rows of `doctype` matching `filters` the current user can read.
+
+    The count runs as a single `COUNT` query through `frappe.get_list`, so it
+    goes through the same filter compiler and permission checks as the list
+    itself. When `estimate_threshold` is set, the count is capped at that many
+    rows. Anything above it is reported as an estimate taken from the table
+    statistics when there are no filters, and otherwise as a lower bound,
+    i.e. "more than `estimate_threshold`".
+
+    :param doctype: DocType to count
+    :param filters: Filters in any format accepted by `frappe.get_list`
+    :param estimate_threshold: Stop counting exactly above this many rows
+    :return: `{"count": int, "is_estimated": bool, "is_lower_bound": bool}`
+    """
+    filters = convert_filter_to_tuple(doctype, filters or {})
+
+    if not estimate_threshold:
+        result = frappe.get_list(
             doctype,
-            fields=rows,
-            filters=not_in_filters,
-            order_by="creation desc",
-            page_length=page_length - len(records),
+            filters=filters,
+            fields=["count(name) as total_count"],
+            order_by=None,
         )
-        for record in remaining_records:
-            records.append(record)
+        count = result[0].total_count if result else 0
+        return frappe._dict(count=cint(count), is_estimated=False, is_lower_bound=False)
 
-    return records
+    # count at most `estimate_threshold + 1` rows to know if the threshold is crossed
+    capped_query = frappe.get_list(
+        doctype,
+        filters=filters,
+        fields=["name"],
+        order_by=None,
+        limit=estimate_threshold + 1,
+        run=False,
+    )
+    count = cint(frappe.db.sql(f"select count(*) from ({capped_query}) p")[0][0])
+    if count <= estimate_threshold:
+        return frappe._dict(count=count, is_estimated=False, is_lower_bound=False)
+
+    if filters:
+        # table statistics cannot tell how many rows match, only that it is more than the threshold
+        return frappe._dict(
+            count=estimate_threshold, is_estimated=False, is_lower_bound=True
+        )
+
+    estimated = max(cint(frappe.db.estimate_count(doctype)), estimate_threshold)
+    return frappe._dict(count=estimated, is_estimated=True, is_lower_bound=False)
 
 
 @frappe.whitelist()
@@ -834,42 +966,69 @@ def get_fields(doctype: str, allow_all_fieldtypes: bool = False):
     return _fields
 
 
-def getCounts(d, doctype):
-    d["_email_count"] = (
-        frappe.db.count(
+def get_activity_counts(doctype, names):
+    """
+    Count emails, comments, todos and notes for many records at once
+
+    Runs one `GROUP BY` query per source table instead of one count per record.
+
+    :param doctype: DocType of the records
+    :param names: Names of the records
+    :return: `{name: {"_email_count": int, "_comment_count": int, ...}}`
+    """
+    counts = {
+        name: {
+            "_email_count": 0,
+            "_comment_count": 0,
+            "_todo_count": 0,
+            "_note_count": 0,
+        }
+        for name in names
+    }
+    if not counts:
+        return counts
+
+    names = list(counts)
+    sources = [
+        (
+            "_email_count",
             "Communication",
-            filters={
+            "reference_name",
+            {
                 "reference_doctype": doctype,
-                "reference_name": d.get("name"),
-                "communication_type": "Communication",
+                "communication_type": ["in", ["Communication", "Automated Message"]],
             },
+        ),
+        (
+            "_comment_count",
+            "Comment",
+            "reference_name",
+            {"reference_doctype": doctype, "comment_type": "Comment"},
+        ),
+        ("_todo_count", "ToDo", "reference_name", {"reference_type": doctype}),
+        ("_note_count", "CRM Note", "parent", {"parenttype": doctype}),
+    ]
+
+    for key, source, link_field, filters in sources:
+        rows = frappe.get_all(
+            source,
+            filters={**filters, link_field: ["in", names]},
+            fields=[f"{link_field} as reference_name", "count(name) as count"],
+            group_by=link_field,
+            order_by=None,
         )
-        or 0
-    )
-    d["_email_count"] = d["_email_count"] + frappe.db.count(
-        "Communication",
-        filters={
-            "reference_doctype": doctype,
-            "reference_name": d.get("name"),
-            "communication_type": "Automated Message",
-        },
-    )
-    d["_comment_count"] = frappe.db.count(
-        "Comment",
-        filters={
-            "reference_doctype": doctype,
-            "reference_name": d.get("name"),
-            "comment_type": "Comment",
-        },
-    )
-    d["_todo_count"] = frappe.db.count(
-        "ToDo", filters={"reference_type": doctype, "reference_name": d.get("name")}
-    )
-    d["_note_count"] = frappe.db.count(
-        "CRM Note",
-        filters={"parenttype": doctype, "parent": d.get("name")},
-    )
-    return d
+        for row in rows:
+            if row.reference_name in counts:
+                counts[row.reference_name][key] = cint(row.count)
+
+    return counts
+
+
+def set_activity_counts(records, doctype):
+    counts = get_activity_counts(doctype, [d.get("name") for d in records])
+    for d in records:
+        d.update(counts.get(d.get("name"), {}))
+    return records
 
 
 @frappe.whitelist()
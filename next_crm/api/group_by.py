@@ -0,0 +1,74 @@
+import frappe
+from frappe import _
+from frappe.model import default_fields, optional_fields
+from frappe.utils import cint
+
+from next_crm.api.pagination import get_cursor_page
+
+
+def get_group_counts(doctype, filters, group_by_field):
+    """
+    Return every value of `group_by_field` among the records matching
+    `filters` with the number of records in each group.
+
+    Empty and unset values are counted together under `""`.
+
+    :return: `{value: count}`
+    """
+    validate_group_by_field(doctype, group_by_field)
+    groups = frappe.get_list(
+        doctype,
+        filters=filters,
+        fields=[f"{group_by_field} as group_value", "count(name) as count"],
+        group_by=group_by_field,
+        order_by=None,
+    )
+
+    counts = {}
+    for group in groups:
+        value = group.group_value if group.group_value is not None else ""
+        counts[value] = counts.get(value, 0) + cint(group.count)
+    return counts
+
+
+@frappe.whitelist()
+def get_group_data(
+    doctype: str,
+    filters: dict,
+    group_by_field: str,
+    group_value: str,
+    order_by: str,
+    rows=None,
+    page_length=20,
+    cursor=None,
+):
+    """
+    Fetch the records of a single expanded group of a group by view
+
+    :param group_value: Value of `group_by_field` to fetch records for, `""` for records without a value
+    :param cursor: Cursor returned with the previous page of this group
+    :return: Records of the group and the cursor for its next page
+    """
+    validate_group_by_field(doctype, group_by_field)
+    filters = frappe._dict(frappe.parse_json(filters) or {})
+    rows = frappe.parse_json(rows or "[]") or ["name"]
+
+    if group_value:
+        filters[group_by_field] = group_value
+    else:
+        filters[group_by_field] = ["is", "not set"]
+
+    if group_by_field not in rows:
+        rows.append(group_by_field)
+
+    data, next_cursor = get_cursor_page(
+        doctype, rows, filters, order_by, page_length, cursor
+    )
+    return {"data": data, "next_cursor": next_cursor}
+
+
+def validate_group_by_field(doctype, group_by_field):
+    if group_by_field in default_fields or group_by_field in optional_fields:
+        return
+    if not frappe.get_meta(doctype).has_field(group_by_field):
+        frappe.throw(_("Invalid group by field {0}").format(group_by_field))
@@ -0,0 +1,146 @@
+import frappe
+from frappe import _
+from frappe.utils import cint, make_filter_tuple
+
+from next_crm.utils import parse_order_by
+
+DEFAULT_PAGE_LENGTH = 20
+
+
+def get_kanban_data(doctype, filters, column_field, columns, rows, order_by):
+    """
+    Fetch the first cards of every kanban column along with the column totals.
+
+    Cards for all columns come from a single query that ranks rows per column
+    with `ROW_NUMBER() OVER (PARTITION BY column_field ...)`, and the totals
+    from a single `GROUP BY column_field` count, or a capped count per column
+    when a count estimate threshold is set in NCRM Settings. Both are built on top of
+    `frappe.get_list`, so filters and permissions apply exactly as they would
+    when fetching one column at a time.
+
+    :param doctype: DocType shown on the board
+    :param filters: Board filters as a dict, `column_field` is ignored if present
+    :param column_field: Field the board is split on
+    :param columns: Columns to fetch, each with a `name` and optionally `page_length` and a manual `order`
+    :param rows: Fields to fetch for each card
+    :param order_by: Sort order of cards in columns without a manual order
+    :return: `(cards, counts)`, both keyed by column name, counts as returned by `get_count`
+    """
+    if not columns:
+        return {}, {}
+
+    if not frappe.get_meta(doctype).has_field(column_field):
+        frappe.throw(_("Invalid column field {0}").format(column_field))
+
+    filters = {key: value for key, value in filters.items() if key != column_field}
+    filters[column_field] = ["in", [column.get("name") for column in columns]]
+    filters = [make_filter_tuple(doctype, key, value) for key, value in filters.items()]
+
+    cards = get_column_cards(doctype, filters, column_field, columns, rows, order_by)
+    counts = get_column_counts(doctype, filters, column_field, columns)
+    return cards, counts
+
+
+def get_column_counts(doctype, filters, column_field, columns):
+    from next_crm.api.doc import get_count, get_count_estimate_threshold
+
+    if estimate_threshold := get_count_estimate_threshold():
+        # a grouped count cannot stop early, count each column up to the threshold
+        filters = [f for f in filters if f[1] != column_field]
+        return {
+            column.get("name"): get_count(
+                doctype,
+                [*filters, [doctype, column_field, "=", column.get("name")]],
+                estimate_threshold=estimate_threshold,
+            )
+            for column in columns
+        }
+
+    counts = frappe.get_list(
+        doctype,
+        filters=filters,
+        fields=[column_field, "count(name) as count"],
+        group_by=column_field,
+        order_by=None,
+    )
+    return {
+        d.get(column_field): frappe._dict(
+            count=cint(d.count), is_estimated=False, is_lower_bound=False
+        )
+        for d in counts
+    }
+
+
+def get_column_cards(doctype, filters, column_field, columns, rows, order_by):
+    page_lengths = {
+        column.get("name"): cint(column.get("page_length")) or DEFAULT_PAGE_LENGTH
+        for column in columns
+    }
+    sort_fields = parse_order_by(order_by) or [("modified", "desc")]
+    fields = list(
+        dict.fromkeys(
+            [*rows, "name", "creation", column_field]
+            + [fieldname for fieldname, _direction in sort_fields]
+        )
+    )
+
+    values = {"page_length": max(page_lengths.values())}
+    conditions = []
+    rank_order = []
+
+    # Manually ordered columns show the first `page_length` cards of their order
+    # on top, followed by the newest cards that are not part of the order at all.
+    pinned_conditions = []
+    ordered_columns = []
+    for i, column in enumerate(c for c in columns if c.get("order")):
+        order = column.get("order")
+        page_length = page_lengths[column.get("name")]
+        ordered_columns.append(column.get("name"))
+        values[f"column_{i}"] = column.get("name")
+        values[f"pinned_{i}"] = tuple(order[:page_length])
+        pinned_conditions.append(
+            f"(p.`{column_field}` = %(column_{i})s and p.name in %(pinned_{i})s)"
+        )
+        if hidden := order[page_length:]:
+            values[f"hidden_{i}"] = tuple(hidden)
+            conditions.append(
+                f"not (p.`{column_field}` = %(column_{i})s and p.name in %(hidden_{i})s)"
+            )
+
+    if ordered_columns:
+        values["ordered_columns"] = tuple(ordered_columns)
+        rank_order.append(f"case when {' or '.join(pinned_conditions)} then 0 else 1 end")
+        rank_order.append(
+            f"case when p.`{column_field}` in %(ordered_columns)s then p.creation end desc"
+        )
+    rank_order += [f"p.`{fieldname}` {direction}" for fieldname, direction in sort_fields]
+
+    base_query = frappe.get_list(
+        doctype, fields=fields, filters=filters, order_by=None, run=False
+    )
+    # values are already inlined in the base query, keep `%` out of parameter substitution
+    base_query = base_query.replace("%", "%%")
+    where = f"where {' and '.join(conditions)}" if conditions else ""
+
+    records = frappe.db.sql(
+        f"""
+        select * from (
+            select p.*, row_number() over (
+                partition by p.`{column_field}` order by {", ".join(rank_order)}
+            ) as _kanban_rank
+            from ({base_query}) p
+            {where}
+        ) ranked
+        where _kanban_rank <= %(page_length)s
+        order by _kanban_rank
+        """,
+        values,
+        as_dict=True,
+    )
+
+    cards = {name: [] for name in page_lengths}
+    for record in records:
+        column = record.get(column_field)
+        if record.pop("_kanban_rank") <= page_lengths.get(column, 0):
+            cards[column].append(record)
+    return cards
@@ -1,5 +1,14 @@
 import frappe
 from frappe.query_builder import Order
+from frappe.utils import cint, get_datetime, now_datetime
+
+from next_crm.api.pagination import decode_cursor, encode_cursor
+from next_crm.ncrm.doctype.crm_notification.crm_notification import (
+    get_unread_count,
+    publish_notification_change,
+)
+
+INBOX_ORDER = "creation desc"
 
 
 @frappe.whitelist()
@@ -12,17 +21,70 @@ def get_notifications():
         .orderby("creation", order=Order.desc)
     )
     notifications = query.run(as_dict=True)
+    return format_notifications(notifications)
+
+
+@frappe.whitelist()
+def get_inbox(cursor=None, page_length=20, unread_only=False):
+    """
+    Fetch one page of the current user's notifications, newest first
+
+    Pages are read with a seek on `(creation, name)`, served by the
+    `(to_user, creation)` index, or `(to_user, read, creation)` for unread
+    notifications only.
+
+    :param cursor: Cursor returned with the previous page, `None` for the newest page
+    :param unread_only: Only return unread notifications
+    :return: `{"data": notifications, "next_cursor": cursor}`, `next_cursor` is `None` on the last page
+    """
+    page_length = cint(page_length) or 20
+    Notification = frappe.qb.DocType("CRM Notification")
+    query = (
+        frappe.qb.from_(Notification)
+        .select("*")
+        .where(Notification.to_user == frappe.session.user)
+        .orderby(Notification.creation, order=Order.desc)
+        .orderby(Notification.name, order=Order.desc)
+        .limit(page_length + 1)
+    )
+    if cint(unread_only):
+        query = query.where(Notification.read == 0)
+    if cursor:
+        creation, name = decode_cursor(cursor, INBOX_ORDER)["values"]
+        creation = get_datetime(creation)
+        query = query.where(
+            (Notification.creation < creation)
+            | ((Notification.creation == creation) & (Notification.name < name))
+        )
+
+    notifications = query.run(as_dict=True)
+    next_cursor = None
+    if len(notifications) > page_length:
+        notifications = notifications[:page_length]
+        last = notifications[-1]
+        next_cursor = encode_cursor(INBOX_ORDER, [last.creation, last.name], 0)
+
+    return {"data": format_notifications(notifications), "next_cursor": next_cursor}
+
+
+@frappe.whitelist()
+def get_unread_notifications_count():
+    """Number of unread notifications of the current user, for the bell badge"""
+    return get_unread_count(frappe.session.user)
+
+
+def format_notifications(notifications):
+    full_names = get_full_names({n.from_user for n in notifications if n.from_user})
 
     _notifications = []
     for notification in notifications:
         _notifications.append(
             {
+                "name": notification.name,
                 "creation": notification.creation,
                 "from_user": {
                     "name": notification.from_user,
-                    "full_name": frappe.get_value(
-                        "User", notification.from_user, "full_name"
-                    ),
+                    "full_name": full_names.get(notification.from_user),
                 },
                 "type": notification.type,
                 "to_user": notification.to_user,
@@ -40,6 +102,20 @@ def get_notifications():
     return _notifications
 
 
+def get_full_names(users):
+    """Return `{user: full_name}` for many users with one query"""
+    if not users:
+        return {}
+    return dict(
+        frappe.get_all(
+            "User",
+            filters={"name": ["in", list(users)]},
+            fields=["name", "full_name"],
+            as_list=True,
+        )
+    )
+
+
 @frappe.whitelist()
 def mark_as_read(user=None, doc=None):
     user = user or frappe.session.user
@@ -50,10 +126,22 @@ def mark_as_read(user=None, doc=None):
             {"comment": doc},
             {"notification_type_doc": doc},
         ]
-    for n in frappe.get_all("CRM Notification", filters=filters, or_filters=or_filters):
-        d = frappe.get_doc("CRM Notification", n.name)
-        d.read = True
-        d.save()
+    names = frappe.get_all(
+        "CRM Notification", filters=filters, or_filters=or_filters, pluck="name"
+    )
+    if not names:
+        return
+
+    Notification = frappe.qb.DocType("CRM Notification")
+    (
+        frappe.qb.update(Notification)
+        .set(Notification.read, 1)
+        .set(Notification.modified, now_datetime())
+        .set(Notification.modified_by, frappe.session.user)
+        .where(Notification.name.isin(names))
+        .run()
+    )
+    publish_notification_change(user, "read", names, delta=-len(names))
 
 
 def get_hash(notification):
@@ -81,3 +169,4 @@ def clear_all_notifications():
     """
     user = frappe.session.user
     frappe.db.delete("CRM Notification", {"to_user": user})
+    publish_notification_change(user, "clear", reset=True)
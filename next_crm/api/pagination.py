@@ -0,0 +1,180 @@
+import base64
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+from next_crm.utils import parse_order_by
+
+# standard columns that can never be NULL, seeking on them alone can use a row comparison
+NOT_NULL_FIELDS = {"name", "creation", "modified"}
+
+
+def get_cursor_page(doctype, rows, filters, order_by, page_length, cursor=None):
+    """
+    Fetch the page of a list that follows `cursor`.
+
+    Rows are read with a seek predicate on the `order_by` columns (plus `name`
+    as a tie-breaker), so loading the next page costs the same no matter how
+    far down the list it is. Empty sort values are seeked past the way
+    MariaDB sorts them, first on ascending and last on descending columns.
+    When the sort order cannot be seeked on, e.g. `order_by` is an
+    expression, the cursor carries a plain offset instead.
+
+    :param doctype: DocType to list
+    :param rows: Fields to fetch
+    :param filters: Filters in any format accepted by `frappe.get_list`
+    :param order_by: Sort order of the list
+    :param page_length: Number of rows to fetch
+    :param cursor: Cursor returned with the previous page, `None` for the first page
+    :return: `(data, next_cursor)`, `next_cursor` is `None` on the last page
+    """
+    page_length = cint(page_length) or 20
+    sort_fields = get_sort_fields(order_by)
+    cursor = decode_cursor(cursor, order_by) if cursor else {}
+    fields = list(dict.fromkeys([*rows, *(field for field, _order in sort_fields)]))
+
+    if sort_fields and cursor.get("values") is None and cursor.get("offset"):
+        # cursor of a page that ended on an empty sort value before those could be seeked past
+        data = get_offset_page(
+            doctype, fields, filters, order_by, page_length, cursor.get("offset")
+        )
+    elif sort_fields:
+        data = get_seek_page(
+            doctype, fields, filters, sort_fields, page_length, cursor.get("values")
+        )
+    else:
+        data = get_offset_page(
+            doctype, fields, filters, order_by, page_length, cursor.get("offset")
+        )
+
+    next_cursor = None
+    if len(data) == page_length:
+        offset = cint(cursor.get("offset")) + len(data)
+        values = None
+        if sort_fields:
+            values = [data[-1].get(field) for field, _order in sort_fields]
+        next_cursor = encode_cursor(order_by, values, offset)
+
+    return data, next_cursor
+
+
+def get_sort_fields(order_by):
+    """
+    Return the `(fieldname, direction)` pairs to seek on, or `[]` if the
+    order cannot be seeked on and offsets have to be used instead.
+    """
+    parts = [part for part in (order_by or "").split(",") if part.strip()]
+    sort_fields = parse_order_by(order_by)
+    if len(sort_fields) != len(parts):
+        return []
+
+    if "name" not in [field for field, _order in sort_fields]:
+        direction = sort_fields[-1][1] if sort_fields else "desc"
+        sort_fields.append(("name", direction))
+    return sort_fields
+
+
+def get_seek_page(doctype, fields, filters, sort_fields, page_length, values=None):
+    base_query = frappe.get_list(
+        doctype, fields=fields, filters=filters, order_by=None, run=False
+    )
+    # values are already inlined in the base query, keep `%` out of parameter substitution
+    base_query = base_query.replace("%", "%%")
+    params = {"page_length": page_length}
+    where = ""
+    if values:
+        params.update({f"cursor_{i}": value for i, value in enumerate(values)})
+        where = f"where {get_seek_condition(sort_fields, values)}"
+
+    order = ", ".join(f"p.`{field}` {direction}" for field, direction in sort_fields)
+    return frappe.db.sql(
+        f"""
+        select * from ({base_query}) p
+        {where}
+        order by {order}
+        limit %(page_length)s
+        """,
+        params,
+        as_dict=True,
+    )
+
+
+def get_seek_condition(sort_fields, values):
+    """
+    Build the predicate selecting rows after the cursor.
+
+    A single row comparison is used when every column sorts the same way and
+    none of them can be NULL. Otherwise it expands to
+    `a > x or (a = x and b < y) or ...`, where every comparison also accounts
+    for NULLs sorting first on ascending and last on descending columns.
+    """
+    directions = {direction for _field, direction in sort_fields}
+    if len(directions) == 1 and all(
+        field in NOT_NULL_FIELDS for field, _order in sort_fields
+    ):
+        operator = "<" if directions.pop() == "desc" else ">"
+        columns = ", ".join(f"p.`{field}`" for field, _order in sort_fields)
+        params = ", ".join(f"%(cursor_{i})s" for i in range(len(sort_fields)))
+        return f"({columns}) {operator} ({params})"
+
+    conditions = []
+    for i, (field, direction) in enumerate(sort_fields):
+        if not (after_cursor := get_after_condition(field, direction, i, values[i])):
+            continue
+        equal_to_cursor = [
+            f"p.`{prev_field}` is null"
+            if values[j] is None
+            else f"p.`{prev_field}` = %(cursor_{j})s"
+            for j, (prev_field, _order) in enumerate(sort_fields[:i])
+        ]
+        conditions.append("(" + " and ".join([*equal_to_cursor, after_cursor]) + ")")
+    return "(" + (" or ".join(conditions) or "false") + ")"
+
+
+def get_after_condition(field, direction, i, value):
+    """Return the predicate for `field` sorting after the cursor value, `None` if nothing can"""
+    column = f"p.`{field}`"
+    if direction == "desc":
+        if value is None:
+            return None
+        nulls = "" if field in NOT_NULL_FIELDS else f" or {column} is null"
+        return f"({column} < %(cursor_{i})s{nulls})"
+
+    if value is None:
+        return f"{column} is not null"
+    return f"{column} > %(cursor_{i})s"
+
+
+def get_offset_page(doctype, fields, filters, order_by, page_length, offset=0):
+    return frappe.get_list(
+        doctype,
+        fields=fields,
+        filters=filters,
+        order_by=order_by,
+        start=cint(offset),
+        page_length=page_length,
+    )
+
+
+def encode_cursor(order_by, values, offset):
+    cursor = json.dumps(
+        {"order_by": order_by, "values": values, "offset": offset},
+        default=str,
+    )
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor, order_by):
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        frappe.throw(_("Invalid cursor"), frappe.ValidationError)
+
+    if not isinstance(cursor, dict) or cursor.get("order_by") != order_by:
+        frappe.throw(
+            _("Cursor does not match the sort order, reload the list"),
+            frappe.ValidationError,
+        )
+    return cursor
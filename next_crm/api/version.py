@@ -0,0 +1,98 @@
+import json
+
+import frappe
+
+FIELD_LABELS_CACHE_KEY = "next_crm:version_field_labels"
+
+
+@frappe.whitelist()
+def get_field_changes(doctype, name):
+    """
+    Fetch the field changes of any document as timeline activities, newest first
+
+    Lets doctypes without a timeline of their own (Prospect, Customer, ...)
+    show their history the same way Leads and Opportunities do.
+    """
+    frappe.has_permission(doctype, "read", name, throw=True)
+    versions = frappe.get_all(
+        "Version",
+        filters={"ref_doctype": doctype, "docname": name},
+        fields=["name", "data", "owner", "creation"],
+        order_by="creation desc",
+    )
+
+    activities = []
+    for version in versions:
+        activities += get_version_activities(version, doctype)
+    return activities
+
+
+def get_version_activities(version, doctype, avoid_fields=(), is_lead=False):
+    """
+    Turn every changed field of a Version into a timeline activity, in one pass
+
+    Fields that are not in the DocType any more, are in `avoid_fields` or
+    went from empty to empty are left out.
+
+    :param version: Version row, with at least `data`, `owner` and `creation`
+    :param doctype: DocType the Version belongs to
+    :return: List of `changed`, `added` and `removed` activities, in the order the fields were changed
+    """
+    data = json.loads(version.data) if isinstance(version.data, str) else version.data
+    changes = (data or {}).get("changed")
+    if not changes:
+        return []
+
+    fields = get_field_labels(doctype)
+    activities = []
+    for fieldname, old_value, value in changes:
+        field = fields.get(fieldname)
+        if not field or fieldname in avoid_fields or (not old_value and not value):
+            continue
+
+        activity_type = "changed"
+        change = {
+            "field": fieldname,
+            "field_label": field["label"] or fieldname,
+            "old_value": old_value,
+            "value": value,
+        }
+        if not old_value:
+            activity_type = "added"
+            del change["old_value"]
+        elif not value:
+            activity_type = "removed"
+            change["value"] = change.pop("old_value")
+
+        activities.append(
+            {
+                "activity_type": activity_type,
+                "creation": version.creation,
+                "owner": version.owner,
+                "data": change,
+                "is_lead": is_lead,
+                "options": field["options"] or None,
+            }
+        )
+    return activities
+
+
+def get_field_labels(doctype):
+    """
+    Return `{fieldname: {"label", "options"}}` of `doctype`
+
+    Labels are left untranslated since the timeline translates them in the
+    browser. Cached per doctype and cleared whenever fields change.
+    """
+    return frappe.cache.hget(
+        FIELD_LABELS_CACHE_KEY,
+        doctype,
+        generator=lambda: {
+            field.fieldname: {"label": field.label, "options": field.options}
+            for field in frappe.get_meta(doctype).fields
+        },
+    )
+
+
+def clear_field_labels_cache(doc=None, method=None):
+    frappe.cache.delete_value(FIELD_LABELS_CACHE_KEY)
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark of the attachment log parser used by the activity timeline
+
+Run with
+
+    bench --site <site> execute next_crm.benchmarks.attachment_log.run
+
+It compares parsing a timeline's worth of attachment logs with a
+BeautifulSoup tree per log (the previous implementation) to the streaming
+parser, both without and with its memoization.
+"""
+
+import timeit
+
+from bs4 import BeautifulSoup
+
+from next_crm.api.activities import parse_attachment_log, parse_first_anchor
+
+
+def parse_with_beautifulsoup(html, type):
+    soup = BeautifulSoup(html, "html.parser")
+    a_tag = soup.find("a")
+    type = "added" if type == "Attachment" else "removed"
+    if not a_tag:
+        return {
+            "type": type,
+            "file_name": html.replace("Removed ", ""),
+            "file_url": "",
+            "is_private": False,
+        }
+
+    return {
+        "type": type,
+        "file_name": a_tag.text,
+        "file_url": a_tag["href"],
+        "is_private": "private/files" in a_tag["href"],
+    }
+
+
+def get_attachment_logs(count, distinct):
+    logs = []
+    for i in range(count):
+        n = i % distinct
+        if i % 4 == 3:
+            logs.append((f"Removed quotation-{n}.pdf", "Attachment Removed"))
+        else:
+            folder = "private/files" if i % 2 else "files"
+            logs.append(
+                (
+                    f'<a href="/{folder}/quotation-{n}.pdf" target="_blank">quotation-{n}.pdf</a>',
+                    "Attachment",
+                )
+            )
+    return logs
+
+
+def run(count=500, distinct=100, repeat=5):
+    """
+    Print the best time out of `repeat` runs for parsing `count` attachment
+    logs, `distinct` of which are different
+    """
+    logs = get_attachment_logs(count, distinct)
+
+    for html, type in logs:
+        assert parse_attachment_log(html, type) == parse_with_beautifulsoup(html, type)
+
+    def beautifulsoup():
+        for html, type in logs:
+            parse_with_beautifulsoup(html, type)
+
+    def streaming():
+        parse_first_anchor.cache_clear()
+        for html, type in logs:
+            parse_attachment_log(html, type)
+
+    def memoized():
+        for html, type in logs:
+            parse_attachment_log(html, type)
+
+    results = {}
+    for name, func in (
+        ("beautifulsoup", beautifulsoup),
+        ("streaming", streaming),
+        ("streaming, memoized", memoized),
+    ):
+        results[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+
+    baseline = results["beautifulsoup"]
+    for name, seconds in results.items():
+        print(
+            f"{name:<22} {seconds * 1000:8.2f} ms  {baseline / seconds:6.1f}x"
+            f"  ({count} logs, {distinct} distinct)"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    run()
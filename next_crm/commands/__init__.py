@@ -0,0 +1,44 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("recompute-sla")
+@click.option("--from-date", help="First SLA creation date to recompute (YYYY-MM-DD)")
+@click.option("--to-date", help="Last SLA creation date to recompute, defaults to today")
+@click.option(
+    "--doctype",
+    "doctypes",
+    multiple=True,
+    type=click.Choice(["Lead", "Opportunity"]),
+    help="Only recompute this doctype, can be repeated",
+)
+@click.option("--batch-size", default=1000, type=int, show_default=True)
+@pass_context
+def recompute_sla(context, from_date=None, to_date=None, doctypes=None, batch_size=1000):
+    """Recompute response by, first response time and SLA status of Leads and Opportunities"""
+    import frappe
+
+    from next_crm.ncrm.doctype.crm_service_level_agreement.recompute import (
+        recompute_sla,
+    )
+
+    def progress(done, total, doctype):
+        click.echo(f"{doctype}: {done}/{total}")
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        updated = recompute_sla(
+            from_date=from_date,
+            to_date=to_date,
+            doctypes=list(doctypes) or None,
+            batch_size=batch_size,
+            progress=progress,
+        )
+        for doctype, count in updated.items():
+            click.secho(f"Updated {count} {doctype} record(s)", fg="green")
+    finally:
+        frappe.destroy()
+
+
+commands = [recompute_sla]
@@ -0,0 +1,37 @@
+from next_crm.ncrm.doctype.crm_activity.crm_activity import (
+    FEED_DOCTYPES,
+    delete_reference_entries,
+    delete_source_entries,
+    get_comment_entries,
+    get_communication_entries,
+    get_version_entries,
+    insert_entries,
+    replace_source_entries,
+)
+
+
+def on_version_insert(doc, method=None):
+    insert_entries(get_version_entries([doc]))
+
+
+def on_comment_update(doc, method=None):
+    """Comments can be edited, so their feed entry is replaced on every save"""
+    if doc.reference_doctype not in FEED_DOCTYPES:
+        return
+    replace_source_entries("Comment", doc.name, get_comment_entries([doc]))
+
+
+def on_communication_update(doc, method=None):
+    if doc.reference_doctype not in FEED_DOCTYPES:
+        return
+    replace_source_entries("Communication", doc.name, get_communication_entries([doc]))
+
+
+def on_source_delete(doc, method=None):
+    if doc.reference_doctype not in FEED_DOCTYPES:
+        return
+    delete_source_entries(doc.doctype, doc.name)
+
+
+def on_record_trash(doc, method=None):
+    delete_reference_entries(doc.doctype, doc.name)
@@ -0,0 +1,23 @@
+import frappe
+
+from next_crm.api.communication import clear_communication_preview
+
+
+def after_insert(doc, method=None):
+    if doc.reference_doctype not in ("Lead", "Opportunity"):
+        return
+    frappe.enqueue(
+        "next_crm.api.communication.cache_communication_preview",
+        queue="short",
+        name=doc.name,
+        enqueue_after_commit=True,
+    )
+
+
+def on_update(doc, method=None):
+    if doc.has_value_changed("content"):
+        clear_communication_preview(doc.name)
+
+
+def after_delete(doc, method=None):
+    clear_communication_preview(doc.name)
@@ -0,0 +1,37 @@
+import frappe
+
+from next_crm.ncrm.doctype.crm_list_row.crm_list_row import (
+    delete_list_row,
+    is_list_row_projection_enabled,
+    refresh_list_row,
+)
+
+
+def on_record_update(doc, method=None):
+    refresh_list_row(doc.doctype, doc.name)
+
+
+def on_record_trash(doc, method=None):
+    delete_list_row(doc.doctype, doc.name)
+
+
+def on_activity_change(doc, method=None):
+    """Refresh the list row of the record a Comment, Communication, ToDo or CRM Note belongs to"""
+    if doc.doctype == "ToDo":
+        refresh_list_row(doc.reference_type, doc.reference_name)
+    elif doc.doctype == "CRM Note":
+        refresh_list_row(doc.parenttype, doc.parent)
+    else:
+        refresh_list_row(doc.reference_doctype, doc.reference_name)
+
+
+def on_user_update(doc, method=None):
+    if not doc.has_value_changed("full_name") or not is_list_row_projection_enabled():
+        return
+    frappe.db.set_value(
+        "CRM List Row",
+        {"crm_owner": doc.name},
+        "crm_owner_name",
+        doc.full_name,
+        update_modified=False,
+    )
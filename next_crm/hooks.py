@@ -159,12 +159,46 @@ doc_events = {
     "ToDo": {
         "after_insert": ["next_crm.doc_events.todo.after_insert"],
         "before_save":["next_crm.doc_events.todo.before_save"],
-        "on_update": ["next_crm.doc_events.todo.on_update"],
+        "on_update": [
+            "next_crm.doc_events.todo.on_update",
+            "next_crm.doc_events.list_row.on_activity_change",
+        ],
         "before_insert": ["next_crm.doc_events.todo.before_insert"],
         "on_trash": ["next_crm.doc_events.todo.on_trash"],
+        "after_delete": ["next_crm.doc_events.list_row.on_activity_change"],
     },
     "Comment": {
-        "on_update": ["next_crm.doc_events.comment.on_update"],
+        "on_update": [
+            "next_crm.doc_events.comment.on_update",
+            "next_crm.doc_events.activity_feed.on_comment_update",
+        ],
+        "after_insert": ["next_crm.doc_events.list_row.on_activity_change"],
+        "after_delete": [
+            "next_crm.doc_events.list_row.on_activity_change",
+            "next_crm.doc_events.activity_feed.on_source_delete",
+        ],
+    },
+    "Communication": {
+        "on_update": [
+            "next_crm.doc_events.communication.on_update",
+            "next_crm.doc_events.activity_feed.on_communication_update",
+        ],
+        "after_insert": [
+            "next_crm.doc_events.communication.after_insert",
+            "next_crm.doc_events.list_row.on_activity_change",
+        ],
+        "after_delete": [
+            "next_crm.doc_events.communication.after_delete",
+            "next_crm.doc_events.list_row.on_activity_change",
+            "next_crm.doc_events.activity_feed.on_source_delete",
+        ],
+    },
+    "Version": {
+        "after_insert": ["next_crm.doc_events.activity_feed.on_version_insert"],
+    },
+    "CRM Note": {
+        "after_insert": ["next_crm.doc_events.list_row.on_activity_change"],
+        "after_delete": ["next_crm.doc_events.list_row.on_activity_change"],
     },
     "WhatsApp Message": {
         "validate": ["next_crm.doc_events.whatsapp_message.validate"],
@@ -172,37 +206,105 @@ doc_events = {
     },
     "User": {
         "before_validate": ["next_crm.doc_events.user.before_validate"],
+        "on_update": ["next_crm.doc_events.list_row.on_user_update"],
+    },
+    "Opportunity": {
+        "on_update": ["next_crm.doc_events.list_row.on_record_update"],
+        "on_trash": [
+            "next_crm.doc_events.opportunity.on_trash",
+            "next_crm.doc_events.list_row.on_record_trash",
+            "next_crm.doc_events.activity_feed.on_record_trash",
+        ],
     },
-    "Opportunity": {"on_trash": ["next_crm.doc_events.opportunity.on_trash"]},
     "Notification Log": {
         "before_save": ["next_crm.doc_events.notification_log.before_save"],
     },
     "Lead": {
-        "on_update": ["next_crm.doc_events.lead.on_update"],
-        "on_trash": ["next_crm.doc_events.lead.on_trash"],
+        "on_update": [
+            "next_crm.doc_events.lead.on_update",
+            "next_crm.doc_events.list_row.on_record_update",
+        ],
+        "on_trash": [
+            "next_crm.doc_events.lead.on_trash",
+            "next_crm.doc_events.list_row.on_record_trash",
+            "next_crm.doc_events.activity_feed.on_record_trash",
+        ],
+    },
+    "Holiday List": {
+        "on_update": [
+            "next_crm.ncrm.doctype.crm_service_level_agreement.crm_service_level_agreement.clear_compiled_sla_cache"
+        ],
+        "on_trash": [
+            "next_crm.ncrm.doctype.crm_service_level_agreement.crm_service_level_agreement.clear_compiled_sla_cache"
+        ],
+    },
+    "DocType": {
+        "on_update": [
+            "next_crm.api.doc.clear_list_meta_cache",
+            "next_crm.api.version.clear_field_labels_cache",
+        ],
+        "on_trash": [
+            "next_crm.api.doc.clear_list_meta_cache",
+            "next_crm.api.version.clear_field_labels_cache",
+        ],
+    },
+    "Custom Field": {
+        "on_update": [
+            "next_crm.api.doc.clear_list_meta_cache",
+            "next_crm.api.version.clear_field_labels_cache",
+        ],
+        "on_trash": [
+            "next_crm.api.doc.clear_list_meta_cache",
+            "next_crm.api.version.clear_field_labels_cache",
+        ],
+    },
+    "Property Setter": {
+        "on_update": [
+            "next_crm.api.doc.clear_list_meta_cache",
+            "next_crm.api.version.clear_field_labels_cache",
+        ],
+        "on_trash": [
+            "next_crm.api.doc.clear_list_meta_cache",
+            "next_crm.api.version.clear_field_labels_cache",
+        ],
+    },
+    "CRM Form Script": {
+        "on_update": ["next_crm.api.doc.clear_list_meta_cache"],
+        "on_trash": ["next_crm.api.doc.clear_list_meta_cache"],
+    },
+    "CRM View Settings": {
+        "on_update": ["next_crm.api.doc.clear_list_meta_cache"],
+        "on_trash": ["next_crm.api.doc.clear_list_meta_cache"],
     },
 }
 
+# Cache
+# ---------------
+
+clear_cache = [
+    "next_crm.api.doc.clear_list_meta_cache",
+    "next_crm.ncrm.doctype.crm_service_level_agreement.crm_service_level_agreement.clear_compiled_sla_cache",
+    "next_crm.ncrm.doctype.crm_service_level_agreement.utils.clear_sla_candidates_cache",
+    "next_crm.api.version.clear_field_labels_cache",
+    "next_crm.api.communication.clear_communication_previews",
+]
+
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"next_crm.tasks.all"
-# 	],
-# 	"daily": [
-# 		"next_crm.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"next_crm.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"next_crm.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"next_crm.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+    "hourly": [
+        "next_crm.ncrm.doctype.crm_notification.crm_notification.reconcile_unread_counts"
+    ],
+    "daily": [
+        "next_crm.ncrm.doctype.crm_notification.crm_notification.apply_retention_policies"
+    ],
+    "cron": {
+        "*/5 * * * *": [
+            "next_crm.ncrm.doctype.crm_service_level_agreement.utils.update_overdue_sla_status"
+        ],
+    },
+}
 
 # Testing
 # -------
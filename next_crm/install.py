@@ -23,6 +23,7 @@ def after_install(force=False):
     add_property_setter()
     add_email_template_custom_fields()
     add_todo_custom_title_field()
+    build_activity_feed()
     erpnext_crm_settings = frappe.get_single("ERPNext CRM Settings")
     erpnext_crm_settings.enabled = True
     erpnext_crm_settings.save()
@@ -263,3 +264,33 @@ def add_todo_custom_title_field():
             ],
         }
         create_custom_fields(custom_fields, ignore_validate=True)
+
+
+def build_activity_feed():
+    """
+    Patches do not run on a fresh install, so mark the CRM Activity feed as
+    built right away when there is nothing to build from, and build it in the
+    background when Leads or Opportunities already exist.
+    """
+    from next_crm.ncrm.doctype.crm_activity.crm_activity import (
+        FEED_DOCTYPES,
+        is_activity_feed_built,
+    )
+
+    if is_activity_feed_built():
+        return
+
+    if any(
+        frappe.get_all(doctype, limit=1, order_by=None, pluck="name")
+        for doctype in FEED_DOCTYPES
+    ):
+        frappe.enqueue(
+            "next_crm.ncrm.doctype.crm_activity.crm_activity.rebuild_activity_feed",
+            queue="long",
+            timeout=7200,
+            job_id="rebuild_activity_feed",
+            deduplicate=True,
+            enqueue_after_commit=True,
+        )
+    else:
+        frappe.db.set_single_value("NCRM Settings", "activity_feed_built", 1)
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, rtCamp and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("CRM Activity", {
+// 	refresh(frm) {
+
+// 	},
+// });
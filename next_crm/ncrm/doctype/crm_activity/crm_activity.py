@@ -0,0 +1,267 @@
+# Copyright (c) 2026, rtCamp and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cint, now_datetime
+
+FEED_DOCTYPES = ("Lead", "Opportunity")
+
+COMMENT_ACTIVITY_TYPES = {
+    "Comment": "comment",
+    "Info": "info_log",
+    "Edit": "info_log",
+    "Label": "info_log",
+    "Attachment": "attachment_log",
+    "Attachment Removed": "attachment_log",
+}
+
+FEED_COLUMNS = [
+    "name",
+    "owner",
+    "creation",
+    "modified",
+    "modified_by",
+    "reference_doctype",
+    "reference_name",
+    "activity_type",
+    "source_doctype",
+    "source_name",
+    "data",
+]
+
+
+class CRMActivity(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index(
+        "CRM Activity", ["reference_doctype", "reference_name", "creation"]
+    )
+
+
+def is_activity_feed_built():
+    return cint(
+        frappe.db.get_single_value("NCRM Settings", "activity_feed_built", cache=True)
+    )
+
+
+def get_version_entries(versions):
+    """
+    Build feed entries for Versions of Leads and Opportunities, one per changed field
+
+    Changed fields are rendered with their label at this point, so reading
+    the feed needs neither the Version JSON nor the DocType meta.
+    """
+    from next_crm.api.activities import AVOID_FIELDS
+    from next_crm.api.version import get_version_activities
+
+    entries = []
+    for version in versions:
+        doctype = version.ref_doctype
+        if doctype not in FEED_DOCTYPES:
+            continue
+
+        for activity in get_version_activities(
+            version, doctype, AVOID_FIELDS[doctype], doctype == "Lead"
+        ):
+            entries.append(
+                get_entry(
+                    doctype, version.docname, "version", "Version", version, activity
+                )
+            )
+    return entries
+
+
+def get_comment_entries(comments):
+    """Build feed entries for Comments, attachment logs are stored parsed"""
+    from next_crm.api.activities import get_comment_activity
+
+    entries = []
+    for comment in comments:
+        activity_type = COMMENT_ACTIVITY_TYPES.get(comment.comment_type)
+        if comment.reference_doctype not in FEED_DOCTYPES or not activity_type:
+            continue
+
+        activity = get_comment_activity(comment, comment.reference_doctype == "Lead")
+        activity.pop("attachments", None)
+        entries.append(
+            get_entry(
+                comment.reference_doctype,
+                comment.reference_name,
+                activity_type,
+                "Comment",
+                comment,
+                activity,
+            )
+        )
+    return entries
+
+
+def get_communication_entries(communications):
+    """
+    Build feed entries for Communications
+
+    Only their position in the timeline is stored, the communication itself
+    is read when the timeline is loaded since its delivery and read status
+    keep changing after it is sent.
+    """
+    entries = []
+    for communication in communications:
+        if communication.reference_doctype not in FEED_DOCTYPES:
+            continue
+        if communication.communication_type not in (
+            "Communication",
+            "Automated Message",
+        ):
+            continue
+
+        activity_type = "communication"
+        if communication.communication_medium == "Event":
+            activity_type = "event_communication"
+        entries.append(
+            get_entry(
+                communication.reference_doctype,
+                communication.reference_name,
+                activity_type,
+                "Communication",
+                communication,
+                {},
+            )
+        )
+    return entries
+
+
+def get_entry(reference_doctype, reference_name, activity_type, source_doctype, source, data):
+    for key in ("creation", "owner", "is_lead"):
+        data.pop(key, None)
+    return frappe._dict(
+        reference_doctype=reference_doctype,
+        reference_name=reference_name,
+        activity_type=activity_type,
+        source_doctype=source_doctype,
+        source_name=source.name,
+        owner=source.owner,
+        creation=source.creation,
+        data=data,
+    )
+
+
+def insert_entries(entries):
+    if not entries:
+        return
+
+    now = now_datetime()
+    user = frappe.session.user if frappe.session else "Administrator"
+    rows = [
+        (
+            frappe.generate_hash(length=10),
+            entry.owner,
+            entry.creation,
+            now,
+            user,
+            entry.reference_doctype,
+            entry.reference_name,
+            entry.activity_type,
+            entry.source_doctype,
+            entry.source_name,
+            json.dumps(entry.data, default=str),
+        )
+        for entry in entries
+    ]
+    frappe.db.bulk_insert("CRM Activity", FEED_COLUMNS, rows)
+
+
+def replace_source_entries(source_doctype, source_name, entries):
+    delete_source_entries(source_doctype, source_name)
+    insert_entries(entries)
+
+
+def delete_source_entries(source_doctype, source_name):
+    frappe.db.delete(
+        "CRM Activity", {"source_doctype": source_doctype, "source_name": source_name}
+    )
+
+
+def delete_reference_entries(reference_doctype, reference_name):
+    frappe.db.delete(
+        "CRM Activity",
+        {"reference_doctype": reference_doctype, "reference_name": reference_name},
+    )
+
+
+def rebuild_activity_feed(doctypes=None, batch_size=200):
+    """
+    Build the CRM Activity feed of existing records from their Versions,
+    Comments and Communications, `batch_size` records at a time
+
+    Timelines keep being built from the docinfo until this has finished.
+    """
+    from next_crm.api.activities import LAZY_COMMUNICATION_FIELDS
+
+    for doctype in doctypes or FEED_DOCTYPES:
+        last_name = ""
+        while True:
+            names = frappe.get_all(
+                doctype,
+                filters={"name": [">", last_name]},
+                order_by="name asc",
+                limit=batch_size,
+                pluck="name",
+            )
+            if not names:
+                break
+
+            versions = frappe.get_all(
+                "Version",
+                filters={"ref_doctype": doctype, "docname": ["in", names]},
+                fields=["name", "ref_doctype", "docname", "data", "owner", "creation"],
+            )
+            comments = frappe.get_all(
+                "Comment",
+                filters={
+                    "reference_doctype": doctype,
+                    "reference_name": ["in", names],
+                    "comment_type": ["in", list(COMMENT_ACTIVITY_TYPES)],
+                },
+                fields=[
+                    "name",
+                    "reference_doctype",
+                    "reference_name",
+                    "comment_type",
+                    "content",
+                    "owner",
+                    "creation",
+                ],
+            )
+            communications = frappe.get_all(
+                "Communication",
+                filters={"reference_doctype": doctype, "reference_name": ["in", names]},
+                fields=[
+                    *LAZY_COMMUNICATION_FIELDS,
+                    "reference_name",
+                    "owner",
+                ],
+            )
+
+            frappe.db.delete(
+                "CRM Activity",
+                {"reference_doctype": doctype, "reference_name": ["in", names]},
+            )
+            insert_entries(
+                get_version_entries(versions)
+                + get_comment_entries(comments)
+                + get_communication_entries(communications)
+            )
+            frappe.db.commit()
+            last_name = names[-1]
+
+    if not doctypes:
+        settings = frappe.get_single("NCRM Settings")
+        settings.activity_feed_built = 1
+        settings.flags.ignore_permissions = True
+        settings.save()
+        frappe.db.commit()
@@ -0,0 +1,287 @@
+# Copyright (c) 2026, rtCamp and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.desk.reportview import get_match_cond
+from frappe.model.document import Document
+from frappe.utils import cint, now_datetime
+
+from next_crm.utils import parse_order_by
+
+# source field -> CRM List Row column
+PROJECTED_FIELDS = {
+    "owner": "record_owner",
+    "creation": "record_creation",
+    "modified": "record_modified",
+    "modified_by": "record_modified_by",
+    "_assign": "assigned_to",
+    "status": "status",
+    "sla_status": "sla_status",
+    "response_by": "response_by",
+    "first_responded_on": "first_responded_on",
+}
+
+PROJECTED_DOCTYPE_FIELDS = {
+    "Lead": {"lead_name": "title", "lead_owner": "crm_owner"},
+    "Opportunity": {"title": "title", "opportunity_owner": "crm_owner"},
+}
+
+PROJECTED_COUNTS = {
+    "_email_count": "email_count",
+    "_comment_count": "comment_count",
+    "_todo_count": "todo_count",
+    "_note_count": "note_count",
+}
+
+
+class CRMListRow(Document):
+    pass
+
+
+def is_list_row_projection_enabled():
+    return cint(
+        frappe.db.get_single_value(
+            "NCRM Settings", "enable_list_row_projection", cache=True
+        )
+    )
+
+
+def are_list_rows_built():
+    return cint(
+        frappe.db.get_single_value("NCRM Settings", "list_rows_built", cache=True)
+    )
+
+
+def get_list_row_name(doctype, name):
+    return f"{doctype}-{name}"
+
+
+def get_source_fields(doctype):
+    return {**PROJECTED_FIELDS, **PROJECTED_DOCTYPE_FIELDS[doctype]}
+
+
+def get_projected_columns(doctype):
+    """Return the fields of `doctype` that can be read from CRM List Row, mapped to their column"""
+    return {
+        "name": "reference_name",
+        **get_source_fields(doctype),
+        **PROJECTED_COUNTS,
+    }
+
+
+def get_list_row_values(doctype, names):
+    """
+    Build CRM List Row values for many records of `doctype` at once
+
+    :return: `{name: {column: value}}`, records that do not exist are left out
+    """
+    from next_crm.api.doc import get_activity_counts
+
+    source_fields = get_source_fields(doctype)
+    records = frappe.get_all(
+        doctype,
+        filters={"name": ["in", names]},
+        fields=["name", *source_fields],
+    )
+    if not records:
+        return {}
+
+    owner_field = next(f for f, c in source_fields.items() if c == "crm_owner")
+    crm_owners = {r.get(owner_field) for r in records if r.get(owner_field)}
+    owner_names = {}
+    if crm_owners:
+        owner_names = dict(
+            frappe.get_all(
+                "User",
+                filters={"name": ["in", list(crm_owners)]},
+                fields=["name", "full_name"],
+                as_list=True,
+            )
+        )
+
+    counts = get_activity_counts(doctype, [r.name for r in records])
+    values = {}
+    for record in records:
+        row = {column: record.get(field) for field, column in source_fields.items()}
+        row["crm_owner_name"] = owner_names.get(row.get("crm_owner"))
+        for key, column in PROJECTED_COUNTS.items():
+            row[column] = counts[record.name][key]
+        values[record.name] = row
+    return values
+
+
+def refresh_list_row(doctype, name):
+    """Bring the CRM List Row of a single record up to date"""
+    if doctype not in PROJECTED_DOCTYPE_FIELDS or not name:
+        return
+    if not is_list_row_projection_enabled():
+        return
+
+    values = get_list_row_values(doctype, [name]).get(name)
+    row_name = get_list_row_name(doctype, name)
+    if values is None:
+        frappe.db.delete("CRM List Row", row_name)
+    elif frappe.db.exists("CRM List Row", row_name):
+        frappe.db.set_value("CRM List Row", row_name, values, update_modified=False)
+    else:
+        frappe.get_doc(
+            {
+                "doctype": "CRM List Row",
+                "reference_doctype": doctype,
+                "reference_name": name,
+                **values,
+            }
+        ).insert(ignore_permissions=True, set_name=row_name)
+
+
+def delete_list_row(doctype, name):
+    if doctype not in PROJECTED_DOCTYPE_FIELDS:
+        return
+    frappe.db.delete("CRM List Row", get_list_row_name(doctype, name))
+
+
+def rebuild_list_rows(doctypes=None, batch_size=500):
+    """
+    Rebuild CRM List Rows from scratch, `batch_size` records at a time
+
+    List views keep reading from the source doctypes until a rebuild of
+    all doctypes has finished.
+    """
+    full_rebuild = not doctypes
+    doctypes = doctypes or list(PROJECTED_DOCTYPE_FIELDS)
+    if full_rebuild:
+        frappe.db.set_single_value("NCRM Settings", "list_rows_built", 0)
+    frappe.db.delete("CRM List Row", {"reference_doctype": ["in", doctypes]})
+    frappe.db.commit()
+    if not is_list_row_projection_enabled():
+        return
+
+    columns = [
+        "reference_doctype",
+        "reference_name",
+        "crm_owner_name",
+        *PROJECTED_FIELDS.values(),
+        "title",
+        "crm_owner",
+        *PROJECTED_COUNTS.values(),
+    ]
+    fields = ["name", "owner", "creation", "modified", "modified_by", *columns]
+
+    for doctype in doctypes:
+        last_name = ""
+        while True:
+            names = frappe.get_all(
+                doctype,
+                filters={"name": [">", last_name]},
+                order_by="name asc",
+                limit=batch_size,
+                pluck="name",
+            )
+            if not names:
+                break
+
+            now = now_datetime()
+            rows = []
+            for name, values in get_list_row_values(doctype, names).items():
+                values.update(reference_doctype=doctype, reference_name=name)
+                rows.append(
+                    (
+                        get_list_row_name(doctype, name),
+                        "Administrator",
+                        now,
+                        now,
+                        "Administrator",
+                        *(values.get(column) for column in columns),
+                    )
+                )
+            frappe.db.bulk_insert("CRM List Row", fields, rows)
+            frappe.db.commit()
+            last_name = names[-1]
+
+    if full_rebuild:
+        frappe.db.set_single_value("NCRM Settings", "list_rows_built", 1)
+        frappe.db.commit()
+
+
+def get_list_rows(doctype, rows, filters, order_by, page_length):
+    """
+    Read a list page from CRM List Row instead of `doctype`
+
+    Only possible once the projection has been built, and when every
+    requested field, filter and sort column is projected and the user can
+    read all records of `doctype`, since the projection does not carry
+    per-record permissions.
+
+    Rows are kept up to date by document events, which `db_set` and
+    `frappe.db.set_value` skip. So the `modified` of every row on the page is
+    checked against its record, and if any differ those rows are refreshed
+    and the page is read from `doctype` instead.
+
+    :return: List rows keyed by the source fieldnames, or `None` if the projection cannot serve this view
+    """
+    if doctype not in PROJECTED_DOCTYPE_FIELDS or not are_list_rows_built():
+        return None
+    if not isinstance(filters, dict):
+        return None
+
+    columns = get_projected_columns(doctype)
+    sort_fields = parse_order_by(order_by)
+    sort_parts = [part for part in (order_by or "").split(",") if part.strip()]
+    if (
+        any(row not in columns for row in rows)
+        or any(key not in columns for key in filters)
+        or len(sort_fields) != len(sort_parts)
+        or any(fieldname not in columns for fieldname, _order in sort_fields)
+    ):
+        return None
+
+    if not frappe.has_permission(doctype, "read") or get_match_cond(doctype):
+        return None
+
+    list_rows = frappe.get_all(
+        "CRM List Row",
+        fields=[
+            *(f"{columns[row]} as {row}" for row in rows),
+            "reference_name as _reference_name",
+            "record_modified as _record_modified",
+        ],
+        filters={
+            "reference_doctype": doctype,
+            **{columns[key]: value for key, value in filters.items()},
+        },
+        order_by=", ".join(
+            f"{columns[fieldname]} {direction}" for fieldname, direction in sort_fields
+        )
+        or None,
+        page_length=page_length,
+    )
+
+    if stale := get_stale_list_rows(doctype, list_rows):
+        for name in stale:
+            refresh_list_row(doctype, name)
+        return None
+
+    for row in list_rows:
+        row.pop("_reference_name")
+        row.pop("_record_modified")
+    return list_rows
+
+
+def get_stale_list_rows(doctype, list_rows):
+    """Return the names of records whose `modified` moved past their list row, or that no longer exist"""
+    if not list_rows:
+        return []
+
+    modified = dict(
+        frappe.get_all(
+            doctype,
+            filters={"name": ["in", [row._reference_name for row in list_rows]]},
+            fields=["name", "modified"],
+            as_list=True,
+        )
+    )
+    return [
+        row._reference_name
+        for row in list_rows
+        if modified.get(row._reference_name) != row._record_modified
+    ]
@@ -0,0 +1,58 @@
+# Copyright (c) 2026, rtCamp and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from next_crm.ncrm.doctype.crm_list_row.crm_list_row import (
+    get_list_row_name,
+    get_list_rows,
+)
+
+
+class TestCRMListRow(FrappeTestCase):
+    def setUp(self):
+        frappe.set_user("Administrator")
+        frappe.db.set_single_value("NCRM Settings", "enable_list_row_projection", 1)
+        frappe.db.set_single_value("NCRM Settings", "list_rows_built", 1)
+
+    def get_list_row(self, lead):
+        return frappe.db.get_value(
+            "CRM List Row",
+            get_list_row_name("Lead", lead),
+            ["title", "status", "crm_owner", "record_owner", "record_modified"],
+            as_dict=True,
+        )
+
+    def test_saved_lead_is_projected(self):
+        lead = frappe.get_doc(
+            {"doctype": "Lead", "first_name": "List Row", "lead_name": "List Row"}
+        ).insert(ignore_permissions=True)
+
+        lead.lead_name = "List Row Renamed"
+        lead.save(ignore_permissions=True)
+        lead.reload()
+
+        row = self.get_list_row(lead.name)
+        self.assertEqual(row.title, lead.lead_name)
+        self.assertEqual(row.status, lead.status)
+        self.assertEqual(row.crm_owner, lead.lead_owner)
+        self.assertEqual(row.record_owner, lead.owner)
+        self.assertEqual(row.record_modified, lead.modified)
+
+    def test_rows_changed_without_hooks_are_refreshed(self):
+        lead = frappe.get_doc(
+            {"doctype": "Lead", "first_name": "List Row", "lead_name": "List Row"}
+        ).insert(ignore_permissions=True)
+        frappe.db.set_value("Lead", lead.name, "lead_name", "Set Without Hooks")
+
+        rows = get_list_rows(
+            "Lead", ["name", "lead_name"], {"name": lead.name}, "modified desc", 20
+        )
+        self.assertIsNone(rows)
+        self.assertEqual(self.get_list_row(lead.name).title, "Set Without Hooks")
+
+        rows = get_list_rows(
+            "Lead", ["name", "lead_name"], {"name": lead.name}, "modified desc", 20
+        )
+        self.assertEqual(rows, [{"name": lead.name, "lead_name": "Set Without Hooks"}])
@@ -1,23 +1,220 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import hashlib
+import json
+
 import frappe
 from frappe.model.document import Document
+from frappe.utils import add_days, cint, now_datetime
+
+UNREAD_COUNT_CACHE_KEY = "next_crm:unread_notifications:"
+
+PURGE_BATCH_SIZE = 1000
+
+# fields that make two notifications the same notification
+DEDUP_FIELDS = (
+    "from_user",
+    "to_user",
+    "type",
+    "message",
+    "notification_text",
+    "notification_type_doctype",
+    "notification_type_doc",
+    "reference_doctype",
+    "reference_name",
+)
 
 
 class CRMNotification(Document):
+    def after_insert(self):
+        publish_notification_change(
+            self.to_user, "insert", [self.name], delta=0 if self.read else 1
+        )
+
     def on_update(self):
-        frappe.publish_realtime("crm_notification")
+        if self.is_new():
+            return
+        delta = 0
+        if self.has_value_changed("read"):
+            delta = -1 if self.read else 1
+        publish_notification_change(self.to_user, "update", [self.name], delta=delta)
+
+    def on_trash(self):
+        publish_notification_change(
+            self.to_user, "delete", [self.name], delta=0 if self.read else -1
+        )
 
     @staticmethod
     def clear_old_logs(days=15):
-        from frappe.query_builder import Interval
-        from frappe.query_builder.functions import Now
+        return purge_notifications(days, read=True)
+
+
+def get_unread_count_key(user):
+    return frappe.cache.make_key(UNREAD_COUNT_CACHE_KEY + user)
+
+
+def get_unread_count(user):
+    """
+    Return the number of unread notifications of `user`
+
+    Kept as a plain Redis integer so it can be changed with INCRBY, the
+    table is only counted when the counter is missing.
+    """
+    key = get_unread_count_key(user)
+    count = frappe.cache.get(key)
+    if count is not None:
+        return max(cint(frappe.safe_decode(count)), 0)
+    return set_unread_count(user, count_unread(user))
+
+
+def count_unread(user):
+    return frappe.db.count("CRM Notification", {"to_user": user, "read": 0})
+
+
+def set_unread_count(user, count):
+    frappe.cache.set(get_unread_count_key(user), count)
+    return count
+
+
+def publish_notification_change(user, action, names=(), delta=0, reset=False):
+    """
+    Once the transaction commits, apply `delta` to the unread counter of
+    `user` and send them a single `crm_notification` event describing the change
+
+    The event only goes to `user`, so other users do not refetch their
+    notifications because of it.
+
+    :param action: `insert`, `update`, `delete`, `read` or `clear`
+    :param names: Notifications that changed
+    :param delta: Change of the number of unread notifications
+    :param reset: Set the unread counter to 0 instead of applying `delta`
+    """
+    names = list(names)
+
+    def publish():
+        key = get_unread_count_key(user)
+        if reset:
+            set_unread_count(user, 0)
+        # a missing counter is counted from the table on next read instead
+        elif delta and frappe.cache.exists(key, shared=True):
+            frappe.cache.incrby(key, delta)
+
+        frappe.publish_realtime(
+            "crm_notification",
+            {
+                "action": action,
+                "names": names,
+                "unread_count": get_unread_count(user),
+            },
+            user=user,
+        )
+
+    frappe.db.after_commit.add(publish)
+
+
+def reconcile_unread_counts():
+    """Repair drift of the cached unread counters from the table, runs hourly"""
+    counts = dict(
+        frappe.get_all(
+            "CRM Notification",
+            filters={"read": 0},
+            fields=["to_user", "count(name) as count"],
+            group_by="to_user",
+            order_by=None,
+            as_list=True,
+        )
+    )
+    prefix = frappe.safe_decode(frappe.cache.make_key(UNREAD_COUNT_CACHE_KEY))
+    for key in frappe.cache.get_keys(UNREAD_COUNT_CACHE_KEY):
+        user = frappe.safe_decode(key)[len(prefix) :]
+        count = cint(counts.get(user))
+        if cint(frappe.safe_decode(frappe.cache.get(key))) != count:
+            set_unread_count(user, count)
+
+
+def apply_retention_policies():
+    """
+    Delete notifications older than the retention periods set in NCRM
+    Settings, runs daily
+
+    :return: `{"read": int, "unread": int}`, number of notifications deleted
+    """
+    purged = {"read": 0, "unread": 0}
+    for key, read in (("read", True), ("unread", False)):
+        days = cint(
+            frappe.db.get_single_value(
+                "NCRM Settings", f"{key}_notification_retention_days"
+            )
+        )
+        if days:
+            purged[key] = purge_notifications(days, read=read)
+
+    frappe.db.set_single_value(
+        "NCRM Settings",
+        "last_notification_purge",
+        f"{now_datetime():%Y-%m-%d %H:%M}: deleted {purged['read']} read and "
+        f"{purged['unread']} unread notifications",
+    )
+    frappe.db.commit()
+    return purged
+
+
+def purge_notifications(days, read=True, batch_size=PURGE_BATCH_SIZE):
+    """
+    Delete read or unread notifications last modified more than `days` ago
+
+    Marking a notification read updates `modified`, so read notifications
+    are kept for `days` after they were read, not after they were sent.
+    Rows are deleted `batch_size` at a time with a commit after each batch,
+    so the table is never locked for long. Each batch is found through the
+    `(read, modified)` index.
+
+    :return: Number of notifications deleted
+    """
+    cutoff = add_days(now_datetime(), -cint(days))
+    purged = 0
+    while True:
+        notifications = frappe.get_all(
+            "CRM Notification",
+            filters={"read": 1 if read else 0, "modified": ["<", cutoff]},
+            fields=["name", "to_user"],
+            order_by=None,
+            limit=batch_size,
+        )
+        if not notifications:
+            break
 
-        table = frappe.qb.DocType("CRM Notification")
         frappe.db.delete(
-            table, filters={"modified": ("<", (Now() - Interval(days=days))), "read": 1}
+            "CRM Notification", {"name": ["in", [n.name for n in notifications]]}
         )
+        if not read:
+            names_by_user = {}
+            for notification in notifications:
+                names_by_user.setdefault(notification.to_user, []).append(
+                    notification.name
+                )
+            for user, names in names_by_user.items():
+                publish_notification_change(user, "delete", names, delta=-len(names))
+
+        frappe.db.commit()
+        purged += len(notifications)
+
+    return purged
+
+
+def on_doctype_update():
+    # `read` is a reserved word, so the index needs an explicit name
+    frappe.db.add_index(
+        "CRM Notification",
+        ["to_user", "`read`", "creation"],
+        index_name="to_user_read_creation_index",
+    )
+    # the full inbox does not filter on `read`, so it needs its own index to page without a filesort
+    frappe.db.add_index("CRM Notification", ["to_user", "creation"])
+    frappe.db.add_index(
+        "CRM Notification", ["`read`", "modified"], index_name="read_modified_index"
+    )
 
 
 def notify_user(args):
@@ -41,6 +238,18 @@ def notify_user(args):
         reference_name=args.redirect_to_docname,
     )
 
-    if frappe.db.exists("CRM Notification", values):
-        return
-    frappe.get_doc(values).insert(ignore_permissions=True)
+    values.dedup_key = get_dedup_key(values)
+
+    # the unique index on dedup_key rejects notifications that were already sent
+    frappe.db.savepoint("notify_user")
+    try:
+        frappe.get_doc(values).insert(ignore_permissions=True)
+    except frappe.UniqueValidationError:
+        frappe.db.rollback(save_point="notify_user")
+        frappe.clear_last_message()
+
+
+def get_dedup_key(values):
+    """Hash of the fields identifying a notification, stored in the unique `dedup_key` column"""
+    identity = json.dumps([values.get(field) for field in DEDUP_FIELDS], default=str)
+    return hashlib.sha256(identity.encode()).hexdigest()
@@ -0,0 +1,123 @@
+from bisect import bisect_left
+from datetime import date, datetime, time, timedelta
+
+ONE_DAY = timedelta(days=1)
+
+
+class BusinessCalendar:
+    """
+    Working time of an SLA: weekly working hours minus holidays
+
+    Elapsed working time is computed by clipping each day's working interval
+    to the requested range, and whole weeks in between are counted in one
+    step, so the cost depends on the number of holidays in the range rather
+    than its length.
+    """
+
+    def __init__(
+        self,
+        working_hours: dict[int, tuple[timedelta, timedelta]],
+        holidays=(),
+    ):
+        """
+        :param working_hours: `{weekday: (start, end)}` with weekday as returned by `date.weekday()` and start/end as time since midnight
+        :param holidays: Dates on which no working time is counted
+        """
+        self.working_hours = {
+            weekday: (start, end)
+            for weekday, (start, end) in working_hours.items()
+            if end > start
+        }
+        self.holidays = sorted(set(holidays))
+        self.holiday_set = set(self.holidays)
+        self.day_seconds = [
+            (end - start).total_seconds()
+            for start, end in (
+                self.working_hours.get(weekday, (timedelta(0), timedelta(0)))
+                for weekday in range(7)
+            )
+        ]
+        self.week_seconds = sum(self.day_seconds)
+
+    def get_working_interval(self, day: date) -> tuple[datetime, datetime] | None:
+        """Return the start and end of working time on `day`, `None` if it is not a working day"""
+        if day in self.holiday_set or day.weekday() not in self.working_hours:
+            return None
+        start, end = self.working_hours[day.weekday()]
+        midnight = datetime.combine(day, time.min)
+        return midnight + start, midnight + end
+
+    def elapsed_seconds(self, start: datetime, end: datetime) -> float:
+        """Return the working seconds between `start` and `end`"""
+        if end <= start:
+            return 0.0
+
+        first_day, last_day = start.date(), end.date()
+        total = self.clipped_seconds(first_day, start, end)
+        if last_day != first_day:
+            total += self.clipped_seconds(last_day, start, end)
+            total += self.working_seconds_between(first_day + ONE_DAY, last_day)
+        return total
+
+    def clipped_seconds(self, day: date, start: datetime, end: datetime) -> float:
+        interval = self.get_working_interval(day)
+        if not interval:
+            return 0.0
+        clipped = min(interval[1], end) - max(interval[0], start)
+        return max(clipped.total_seconds(), 0.0)
+
+    def working_seconds_between(self, from_day: date, to_day: date) -> float:
+        """Return the working seconds of the whole days from `from_day` up to, but excluding, `to_day`"""
+        days = (to_day - from_day).days
+        if days <= 0:
+            return 0.0
+
+        weeks, remaining_days = divmod(days, 7)
+        total = weeks * self.week_seconds
+        for i in range(remaining_days):
+            total += self.day_seconds[(from_day.weekday() + i) % 7]
+
+        lo = bisect_left(self.holidays, from_day)
+        hi = bisect_left(self.holidays, to_day)
+        for holiday in self.holidays[lo:hi]:
+            total -= self.day_seconds[holiday.weekday()]
+        return total
+
+    def add_working_seconds(self, start: datetime, seconds: float) -> datetime | None:
+        """
+        Return the moment `seconds` of working time after `start`
+
+        :return: `None` if the calendar has no working time at all
+        """
+        if seconds <= 0:
+            return start
+        if not self.week_seconds:
+            return None
+
+        remaining = seconds
+        day = start.date()
+        interval = self.get_working_interval(day)
+        if interval and start < interval[1]:
+            from_time = max(interval[0], start)
+            available = (interval[1] - from_time).total_seconds()
+            if remaining <= available:
+                return from_time + timedelta(seconds=remaining)
+            remaining -= available
+        day += ONE_DAY
+
+        # skip whole weeks, leaving at most a week of working time to walk through
+        while True:
+            week_seconds = self.working_seconds_between(day, day + 7 * ONE_DAY)
+            if remaining <= week_seconds:
+                break
+            remaining -= week_seconds
+            day += 7 * ONE_DAY
+
+        while True:
+            interval = self.get_working_interval(day)
+            if interval:
+                available = (interval[1] - interval[0]).total_seconds()
+                if remaining <= available:
+                    return interval[0] + timedelta(seconds=remaining)
+                remaining -= available
+            day += ONE_DAY
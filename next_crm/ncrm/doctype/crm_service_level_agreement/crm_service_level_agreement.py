@@ -1,21 +1,25 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
-from datetime import timedelta
-
 import frappe
 from frappe import _
 from frappe.model.document import Document
 from frappe.utils import (
-    add_to_date,
     get_datetime,
     get_weekdays,
-    getdate,
     now_datetime,
-    time_diff_in_seconds,
+    to_timedelta,
 )
 
-from next_crm.ncrm.doctype.crm_service_level_agreement.utils import get_context
+from next_crm.ncrm.doctype.crm_service_level_agreement.business_time import (
+    BusinessCalendar,
+)
+from next_crm.ncrm.doctype.crm_service_level_agreement.utils import (
+    clear_sla_candidates_cache,
+    get_context,
+)
+
+SLA_CACHE_KEY = "next_crm:compiled_sla"
 
 
 class CRMServiceLevelAgreement(Document):
@@ -24,6 +28,14 @@ class CRMServiceLevelAgreement(Document):
         self.validate_condition()
         self.validate_weekdays()
 
+    def on_update(self):
+        frappe.cache.hdel(SLA_CACHE_KEY, self.name)
+        clear_sla_candidates_cache()
+
+    def on_trash(self):
+        frappe.cache.hdel(SLA_CACHE_KEY, self.name)
+        clear_sla_candidates_cache()
+
     def validate_default(self):
         if self.default:
             filters = {"apply_on": self.apply_on, "default": True}
@@ -87,7 +99,7 @@ class CRMServiceLevelAgreement(Document):
         self.set_first_response_time(doc)
 
     def set_first_responded_on(self, doc: Document):
-        if doc.communication_status != self.get_default_priority():
+        if doc.communication_status != self.get_compiled().default_priority:
             doc.first_responded_on = doc.first_responded_on or now_datetime()
 
     def set_first_response_time(self, doc: Document):
@@ -104,7 +116,7 @@ class CRMServiceLevelAgreement(Document):
         start_time = doc.sla_creation
         communication_status = doc.communication_status
 
-        priorities = self.get_priorities()
+        priorities = self.get_compiled().priorities
         priority = priorities.get(communication_status)
         if not priority or doc.response_by:
             return
@@ -135,68 +147,57 @@ class CRMServiceLevelAgreement(Document):
         start_at: str,
         duration_seconds: int,
     ):
-        res = get_datetime(start_at)
-        time_needed = duration_seconds
-        holidays = self.get_holidays()
-        weekdays = get_weekdays()
-        workdays = self.get_workdays()
-        while time_needed:
-            today = res
-            today_day = getdate(today)
-            today_weekday = weekdays[today.weekday()]
-            is_workday = today_weekday in workdays
-            is_holiday = today_day in holidays
-            if is_holiday or not is_workday:
-                res = add_to_date(res, days=1, as_datetime=True)
-                continue
-            today_workday = workdays[today_weekday]
-            now_in_seconds = time_diff_in_seconds(today, today_day)
-            start_time = max(today_workday.start_time.total_seconds(), now_in_seconds)
-            till_start_time = max(start_time - now_in_seconds, 0)
-            end_time = max(today_workday.end_time.total_seconds(), now_in_seconds)
-            time_left = max(end_time - start_time, 0)
-            if not time_left:
-                res = getdate(add_to_date(res, days=1, as_datetime=True))
-                continue
-            time_taken = min(time_needed, time_left)
-            time_needed -= time_taken
-            time_required = till_start_time + time_taken
-            res = add_to_date(res, seconds=time_required, as_datetime=True)
-        return res
+        """
+        Get the moment `duration_seconds` of working time after `start_at`
+
+        :param start_at: Date at which calculation starts
+        :param duration_seconds: Working time to add
+        :return: Datetime, `None` if the SLA has no working hours
+        """
+        return self.get_compiled().calendar.add_working_seconds(
+            get_datetime(start_at), duration_seconds
+        )
 
     def calc_elapsed_time(self, start_time, end_time) -> float:
         """
-        Get took from start to end, excluding non-working hours
+        Get took from start to end, excluding non-working hours and holidays
 
         :param start_at: Date at which calculation starts
         :param end_at: Date at which calculation ends
         :return: Number of seconds
         """
-        start_time = get_datetime(start_time)
-        end_time = get_datetime(end_time)
-        holiday_list = []
-        working_day_list = self.get_working_days()
-        working_hours = self.get_working_hours()
-
-        total_seconds = 0
-        current_time = start_time
-
-        while current_time < end_time:
-            in_holiday_list = current_time.date() in holiday_list
-            not_in_working_day_list = (
-                get_weekdays()[current_time.weekday()] not in working_day_list
+        return self.get_compiled().calendar.elapsed_seconds(
+            get_datetime(start_time), get_datetime(end_time)
+        )
+
+    def get_compiled(self) -> frappe._dict:
+        """
+        Return the compiled calendar and priorities of this SLA, shared
+        through the cache between all documents the SLA is applied to
+        """
+        if self.is_new():
+            return self.compile()
+        if not getattr(self, "_compiled", None):
+            self._compiled = get_compiled_sla(self.name)
+        return self._compiled
+
+    def compile(self) -> frappe._dict:
+        weekdays = get_weekdays()
+        working_hours = {
+            weekdays.index(row.workday): (
+                to_timedelta(row.start_time),
+                to_timedelta(row.end_time),
             )
-            if (
-                in_holiday_list
-                or not_in_working_day_list
-                or not self.is_working_time(current_time, working_hours)
-            ):
-                current_time += timedelta(seconds=1)
-                continue
-            total_seconds += 1
-            current_time += timedelta(seconds=1)
-
-        return total_seconds
+            for row in self.working_hours
+        }
+        return frappe._dict(
+            calendar=BusinessCalendar(working_hours, self.get_holidays()),
+            priorities={
+                row.priority: frappe._dict(first_response_time=row.first_response_time)
+                for row in self.priorities
+            },
+            default_priority=self.get_default_priority(),
+        )
 
     def get_priorities(self):
         """
@@ -226,26 +227,6 @@ class CRMServiceLevelAgreement(Document):
             res[row.workday] = row
         return res
 
-    def get_working_days(self) -> dict[str, dict]:
-        workdays = []
-        for row in self.working_hours:
-            workdays.append(row.workday)
-        return workdays
-
-    def get_working_hours(self) -> dict[str, dict]:
-        res = {}
-        for row in self.working_hours:
-            res[row.workday] = (row.start_time, row.end_time)
-        return res
-
-    def is_working_time(self, date_time, working_hours):
-        day_of_week = get_weekdays()[date_time.weekday()]
-        start_time, end_time = working_hours.get(day_of_week, (0, 0))
-        date_time = timedelta(
-            hours=date_time.hour, minutes=date_time.minute, seconds=date_time.second
-        )
-        return start_time <= date_time < end_time
-
     def get_holidays(self):
         res = []
         if not self.holiday_list:
@@ -254,3 +235,15 @@ class CRMServiceLevelAgreement(Document):
         for row in holiday_list.holidays:
             res.append(row.holiday_date)
         return res
+
+
+def get_compiled_sla(name: str) -> frappe._dict:
+    return frappe.cache.hget(
+        SLA_CACHE_KEY,
+        name,
+        generator=lambda: frappe.get_doc("CRM Service Level Agreement", name).compile(),
+    )
+
+
+def clear_compiled_sla_cache(doc=None, method=None):
+    frappe.cache.delete_value(SLA_CACHE_KEY)
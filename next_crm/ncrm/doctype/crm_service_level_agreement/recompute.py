@@ -0,0 +1,202 @@
+import frappe
+from frappe import _
+from frappe.utils import add_days, flt, get_datetime, getdate, now_datetime
+
+from next_crm.ncrm.doctype.crm_list_row.crm_list_row import (
+    PROJECTED_FIELDS,
+    get_list_row_name,
+    is_list_row_projection_enabled,
+)
+from next_crm.ncrm.doctype.crm_service_level_agreement.crm_service_level_agreement import (
+    get_compiled_sla,
+)
+from next_crm.ncrm.doctype.crm_service_level_agreement.utils import (
+    SLA_DOCTYPE_OWNER_FIELDS,
+)
+
+
+def recompute_sla(
+    from_date=None,
+    to_date=None,
+    doctypes=None,
+    batch_size: int = 1000,
+    progress=None,
+):
+    """
+    Recompute `response_by`, `first_response_time` and `sla_status` of
+    records whose SLA started between `from_date` and `to_date`
+
+    Meant for after working hours or holidays of an SLA changed. Records are
+    read and written in batches, every batch is computed against the
+    compiled calendar of its SLAs and the records whose values changed are
+    written back, along with their CRM List Rows, with one bulk UPDATE each,
+    without loading or saving documents.
+
+    :param from_date: First `sla_creation` date to include, defaults to the beginning
+    :param to_date: Last `sla_creation` date to include, defaults to today
+    :param doctypes: Doctypes to recompute, defaults to Lead and Opportunity
+    :param progress: Called with `(done, total, doctype)` after every batch
+    :return: Number of records updated per doctype
+    """
+    doctypes = doctypes or list(SLA_DOCTYPE_OWNER_FIELDS)
+    to_date = getdate(to_date)
+    updated = {}
+
+    for doctype in doctypes:
+        filters = [
+            ["sla", "is", "set"],
+            ["sla_creation", "<", add_days(to_date, 1)],
+        ]
+        if from_date:
+            filters.append(["sla_creation", ">=", getdate(from_date)])
+        total = frappe.db.count(doctype, filters)
+        has_first_response_time = frappe.get_meta(doctype).has_field(
+            "first_response_time"
+        )
+        fields = [
+            "name",
+            "sla",
+            "sla_creation",
+            "communication_status",
+            "first_responded_on",
+            "response_by",
+            "sla_status",
+        ]
+        if has_first_response_time:
+            fields.append("first_response_time")
+
+        done = 0
+        updated[doctype] = 0
+        last_name = ""
+        while True:
+            records = frappe.get_all(
+                doctype,
+                filters=[*filters, ["name", ">", last_name]],
+                fields=fields,
+                order_by="name asc",
+                limit=batch_size,
+            )
+            if not records:
+                break
+
+            updates = compute_sla_fields(records, has_first_response_time)
+            if updates:
+                frappe.db.bulk_update(doctype, updates, update_modified=False)
+                update_list_rows(doctype, updates)
+            frappe.db.commit()
+
+            done += len(records)
+            updated[doctype] += len(updates)
+            last_name = records[-1].name
+            if progress:
+                progress(done, total, doctype)
+
+    return updated
+
+
+def compute_sla_fields(records, has_first_response_time=True) -> dict:
+    """
+    Compute SLA fields for a batch of records the way
+    `CRMServiceLevelAgreement.apply` would on save
+
+    :return: `{name: {field: value}}` with only the values that changed, for records where any did
+    """
+    now = now_datetime()
+    compiled_slas = {}
+    updates = {}
+
+    for record in records:
+        if record.sla not in compiled_slas:
+            try:
+                compiled_slas[record.sla] = get_compiled_sla(record.sla)
+            except frappe.DoesNotExistError:
+                compiled_slas[record.sla] = None
+        sla = compiled_slas[record.sla]
+        if not sla or not record.sla_creation:
+            continue
+
+        stored = {
+            "response_by": get_datetime(record.response_by) if record.response_by else None,
+            "first_response_time": flt(record.get("first_response_time")),
+            "sla_status": record.sla_status,
+        }
+        values = {}
+        sla_creation = get_datetime(record.sla_creation)
+        first_responded_on = (
+            get_datetime(record.first_responded_on) if record.first_responded_on else None
+        )
+
+        response_by = get_datetime(record.response_by) if record.response_by else None
+        if priority := sla.priorities.get(record.communication_status):
+            response_by = sla.calendar.add_working_seconds(
+                sla_creation, priority.first_response_time or 0
+            )
+            values["response_by"] = response_by
+
+        if has_first_response_time and first_responded_on:
+            values["first_response_time"] = sla.calendar.elapsed_seconds(
+                sla_creation, first_responded_on
+            )
+
+        if response_by:
+            if not first_responded_on:
+                values["sla_status"] = (
+                    "Failed" if response_by < now else "First Response Due"
+                )
+            else:
+                values["sla_status"] = (
+                    "Failed" if response_by < first_responded_on else "Fulfilled"
+                )
+
+        if "first_response_time" in values:
+            values["first_response_time"] = flt(values["first_response_time"])
+        changed = {
+            field: value for field, value in values.items() if value != stored[field]
+        }
+        if changed:
+            updates[record.name] = changed
+
+    return updates
+
+
+def update_list_rows(doctype, updates):
+    """Copy recomputed values to the CRM List Rows of the records, when the projection is kept"""
+    if not is_list_row_projection_enabled():
+        return
+
+    list_row_updates = {}
+    for name, values in updates.items():
+        projected = {
+            PROJECTED_FIELDS[field]: value
+            for field, value in values.items()
+            if field in PROJECTED_FIELDS
+        }
+        if projected:
+            list_row_updates[get_list_row_name(doctype, name)] = projected
+    if list_row_updates:
+        frappe.db.bulk_update("CRM List Row", list_row_updates, update_modified=False)
+
+
+@frappe.whitelist()
+def enqueue_recompute_sla(from_date=None, to_date=None, doctypes=None):
+    frappe.only_for("System Manager")
+    doctypes = frappe.parse_json(doctypes) if doctypes else None
+    frappe.enqueue(
+        recompute_sla,
+        queue="long",
+        timeout=3600,
+        job_id="recompute_sla",
+        deduplicate=True,
+        from_date=from_date,
+        to_date=to_date,
+        doctypes=doctypes,
+        progress=publish_recompute_progress,
+    )
+
+
+def publish_recompute_progress(done, total, doctype):
+    frappe.publish_progress(
+        done * 100 / (total or 1),
+        title=_("Recomputing SLA"),
+        description=_("{0}: {1} of {2}").format(_(doctype), done, total),
+    )
@@ -1,9 +1,98 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
+import random
+from datetime import date, datetime, timedelta
+
 # import frappe
 from frappe.tests import UnitTestCase
 
+from next_crm.ncrm.doctype.crm_service_level_agreement.business_time import (
+    BusinessCalendar,
+)
+
+
+def brute_force_elapsed_seconds(working_hours, holidays, start, end):
+    """Count working seconds one second at a time, like the original SLA loop"""
+    total = 0
+    current = start
+    while current < end:
+        hours = working_hours.get(current.weekday())
+        since_midnight = current - datetime.combine(current.date(), datetime.min.time())
+        if (
+            current.date() not in holidays
+            and hours
+            and hours[0] <= since_midnight < hours[1]
+        ):
+            total += 1
+        current += timedelta(seconds=1)
+    return total
+
+
+def random_working_hours(rng):
+    working_hours = {}
+    for weekday in rng.sample(range(7), rng.randint(0, 7)):
+        start = rng.randint(0, 20 * 60) * 60
+        end = rng.randint(start // 60 + 1, 24 * 60 - 1) * 60
+        working_hours[weekday] = (timedelta(seconds=start), timedelta(seconds=end))
+    return working_hours
+
 
 class TestCRMServiceLevelAgreement(UnitTestCase):
-    pass
+    def test_elapsed_seconds_matches_brute_force(self):
+        rng = random.Random(20261018)
+        base = datetime(2026, 1, 1)
+
+        for _ in range(25):
+            working_hours = random_working_hours(rng)
+            holidays = {
+                date(2026, 1, 1) + timedelta(days=rng.randint(0, 6))
+                for _ in range(rng.randint(0, 3))
+            }
+            start = base + timedelta(seconds=rng.randint(0, 3 * 86400))
+            end = start + timedelta(seconds=rng.randint(0, 3 * 86400))
+
+            calendar = BusinessCalendar(working_hours, holidays)
+            self.assertEqual(
+                calendar.elapsed_seconds(start, end),
+                brute_force_elapsed_seconds(working_hours, holidays, start, end),
+                msg=f"{working_hours=} {holidays=} {start=} {end=}",
+            )
+
+    def test_add_working_seconds_is_inverse_of_elapsed_seconds(self):
+        rng = random.Random(20261019)
+        base = datetime(2026, 1, 1)
+
+        for _ in range(200):
+            working_hours = random_working_hours(rng)
+            holidays = {
+                date(2026, 1, 1) + timedelta(days=rng.randint(0, 60))
+                for _ in range(rng.randint(0, 10))
+            }
+            calendar = BusinessCalendar(working_hours, holidays)
+            start = base + timedelta(seconds=rng.randint(0, 30 * 86400))
+            seconds = rng.randint(1, 60 * 3600)
+
+            end = calendar.add_working_seconds(start, seconds)
+            if not calendar.week_seconds:
+                self.assertIsNone(end)
+                continue
+            self.assertEqual(calendar.elapsed_seconds(start, end), seconds)
+            self.assertIsNotNone(calendar.get_working_interval(end.date()))
+
+    def test_elapsed_seconds_over_many_weeks(self):
+        nine_to_five = (timedelta(hours=9), timedelta(hours=17))
+        calendar = BusinessCalendar(
+            {weekday: nine_to_five for weekday in range(5)},
+            holidays=[date(2026, 1, 1), date(2026, 1, 3)],
+        )
+
+        # 2026-01-01 is a Thursday, Jan 3 is a Saturday so only Jan 1 is lost
+        elapsed = calendar.elapsed_seconds(datetime(2026, 1, 1), datetime(2026, 3, 2))
+        self.assertEqual(elapsed, (42 - 1) * 8 * 3600)
+
+    def test_elapsed_seconds_is_zero_for_reversed_range(self):
+        calendar = BusinessCalendar({0: (timedelta(0), timedelta(hours=24))})
+        self.assertEqual(
+            calendar.elapsed_seconds(datetime(2026, 1, 5), datetime(2026, 1, 4)), 0
+        )
@@ -1,9 +1,12 @@
+import ast
+from functools import lru_cache
+
 import frappe
 from frappe.model.document import Document
-from frappe.query_builder import JoinType
-from frappe.utils import now_datetime
+from frappe.utils import getdate, now_datetime
 from frappe.utils.safe_exec import get_safe_globals
-from pypika import Criterion
+
+SLA_CANDIDATES_CACHE_KEY = "next_crm:sla_candidates"
 
 
 def get_sla(doc: Document) -> Document:
@@ -13,40 +16,161 @@ def get_sla(doc: Document) -> Document:
     :param doc: Lead/Opportunity to use
     :return: Applicable SLA
     """
-    SLA = frappe.qb.DocType("CRM Service Level Agreement")
-    Priority = frappe.qb.DocType("CRM Service Level Priority")
-    now = now_datetime()
+    today = getdate()
     priority = doc.communication_status
-    q = (
-        frappe.qb.from_(SLA)
-        .select(SLA.name, SLA.condition)
-        .where(SLA.apply_on == doc.doctype)
-        .where(SLA.enabled == True)  # noqa: E712
-        .where(Criterion.any([SLA.start_date.isnull(), SLA.start_date <= now]))
-        .where(Criterion.any([SLA.end_date.isnull(), SLA.end_date >= now]))
-    )
-    if priority:
-        q = (
-            q.join(Priority, JoinType.inner)
-            .on(Priority.parent == SLA.name)
-            .where(Priority.priority == priority)
-        )
-    sla_list = q.run(as_dict=True)
-    res = None
+    sla_list = [
+        sla
+        for sla in get_sla_candidates(doc.doctype)
+        if (not sla.start_date or getdate(sla.start_date) <= today)
+        and (not sla.end_date or getdate(sla.end_date) >= today)
+        and (not priority or priority in sla.priorities)
+    ]
 
     # move default sla to the end of the list
-    for sla in sla_list:
-        if sla.get("default") is True:
-            sla_list.remove(sla)
-            sla_list.append(sla)
-            break
+    sla_list.sort(key=lambda sla: bool(sla.default))
 
     for sla in sla_list:
         cond = sla.get("condition")
-        if not cond or frappe.safe_eval(cond, None, get_context(doc)):
-            res = sla
-            break
-    return res
+        if not cond or evaluate_condition(cond, doc):
+            return sla
+    return None
+
+
+def get_sla_candidates(doctype: str) -> list[frappe._dict]:
+    """
+    Return the enabled SLAs that apply on `doctype` with their priorities
+
+    Cached per doctype until an SLA is changed.
+    """
+
+    def _get_candidates():
+        SLA = frappe.qb.DocType("CRM Service Level Agreement")
+        Priority = frappe.qb.DocType("CRM Service Level Priority")
+        rows = (
+            frappe.qb.from_(SLA)
+            .left_join(Priority)
+            .on((Priority.parent == SLA.name) & (Priority.parenttype == "CRM Service Level Agreement"))
+            .select(
+                SLA.name,
+                SLA.condition,
+                SLA.default,
+                SLA.start_date,
+                SLA.end_date,
+                Priority.priority,
+            )
+            .where(SLA.apply_on == doctype)
+            .where(SLA.enabled == True)  # noqa: E712
+            .orderby(SLA.creation)
+            .run(as_dict=True)
+        )
+        candidates = {}
+        for row in rows:
+            sla = candidates.setdefault(
+                row.name,
+                frappe._dict(
+                    name=row.name,
+                    condition=row.condition,
+                    default=row.default,
+                    start_date=row.start_date,
+                    end_date=row.end_date,
+                    priorities=[],
+                ),
+            )
+            if row.priority:
+                sla.priorities.append(row.priority)
+        return list(candidates.values())
+
+    return frappe.cache.hget(SLA_CANDIDATES_CACHE_KEY, doctype, generator=_get_candidates)
+
+
+def evaluate_condition(condition: str, doc: Document):
+    """
+    Evaluate an SLA condition against `doc` with `frappe.safe_eval`
+
+    The context only holds the fields of `doc` the condition refers to, so
+    `doc` is not converted to a dict for every SLA that is tried.
+    """
+    doc_fields, names = get_condition_names(condition)
+
+    context = {}
+    if "doc" in names:
+        if doc_fields is None:
+            context["doc"] = doc.as_dict()
+        else:
+            context["doc"] = frappe._dict(
+                {field: get_context_value(doc, field) for field in doc_fields}
+            )
+    if "frappe" in names:
+        context["frappe"] = frappe._dict(utils=get_safe_globals().get("frappe").get("utils"))
+
+    return frappe.safe_eval(condition, None, context)
+
+
+@lru_cache(maxsize=256)
+def get_condition_names(condition: str):
+    """
+    Find what an SLA condition reads, once per process
+
+    :return: `(doc_fields, names)`, `doc_fields` lists the fields read from `doc`
+        or is `None` when the condition uses `doc` in a way that needs all of it
+    """
+    try:
+        tree = ast.parse(condition.strip(), mode="eval")
+    except SyntaxError:
+        # let `frappe.safe_eval` report it, with everything in context
+        return None, frozenset({"doc", "frappe"})
+
+    names = frozenset(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+    doc_fields = set()
+    doc_nodes = set()
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Attribute | ast.Subscript) and is_doc(node.value)):
+            continue
+        if isinstance(node, ast.Attribute) and node.attr != "get":
+            doc_fields.add(node.attr)
+            doc_nodes.add(id(node.value))
+        elif isinstance(node, ast.Subscript) and is_constant_str(node.slice):
+            doc_fields.add(node.slice.value)
+            doc_nodes.add(id(node.value))
+
+    # doc.get("field") calls
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "get"
+            and is_doc(node.func.value)
+            and node.args
+            and is_constant_str(node.args[0])
+        ):
+            doc_fields.add(node.args[0].value)
+            doc_nodes.add(id(node.func.value))
+
+    # any other use of `doc` needs the whole document
+    all_doc_nodes = {id(node) for node in ast.walk(tree) if is_doc(node)}
+    if all_doc_nodes - doc_nodes:
+        return None, names
+    return frozenset(doc_fields), names
+
+
+def get_context_value(doc: Document, field: str):
+    value = doc.get(field)
+    if isinstance(value, list):
+        # child tables are plain dicts in `doc.as_dict()`
+        return [row.as_dict() if isinstance(row, Document) else row for row in value]
+    return value
+
+
+def is_doc(node) -> bool:
+    return isinstance(node, ast.Name) and node.id == "doc"
+
+
+def is_constant_str(node) -> bool:
+    return isinstance(node, ast.Constant) and isinstance(node.value, str)
+
+
+def clear_sla_candidates_cache(doc=None, method=None):
+    frappe.cache.delete_value(SLA_CANDIDATES_CACHE_KEY)
 
 
 def get_context(d: Document) -> dict:
@@ -61,3 +185,62 @@ def get_context(d: Document) -> dict:
         "doc": d.as_dict(),
         "frappe": frappe._dict(utils=utils),
     }
+
+
+SLA_DOCTYPE_OWNER_FIELDS = {
+    "Lead": "lead_owner",
+    "Opportunity": "opportunity_owner",
+}
+
+
+def update_overdue_sla_status(batch_size: int = 1000):
+    """
+    Mark records whose first response is overdue as "Failed"
+
+    `sla_status` is otherwise only updated when the record is saved. Records
+    are updated in set-based batches without loading documents, and each
+    owner of an affected record gets a single realtime event listing them.
+    """
+    now = now_datetime()
+    affected = {}
+
+    for doctype, owner_field in SLA_DOCTYPE_OWNER_FIELDS.items():
+        Table = frappe.qb.DocType(doctype)
+        while True:
+            records = (
+                frappe.qb.from_(Table)
+                .select(Table.name, Table[owner_field].as_("owner"))
+                .where(Table.sla_status == "First Response Due")
+                .where(Table.first_responded_on.isnull())
+                .where(Table.response_by < now)
+                .limit(batch_size)
+                .run(as_dict=True)
+            )
+            if not records:
+                break
+
+            names = [r.name for r in records]
+            (
+                frappe.qb.update(Table)
+                .set(Table.sla_status, "Failed")
+                .where(Table.name.isin(names))
+                .run()
+            )
+            ListRow = frappe.qb.DocType("CRM List Row")
+            (
+                frappe.qb.update(ListRow)
+                .set(ListRow.sla_status, "Failed")
+                .where(ListRow.reference_doctype == doctype)
+                .where(ListRow.reference_name.isin(names))
+                .run()
+            )
+            frappe.db.commit()
+
+            for record in records:
+                if record.owner:
+                    affected.setdefault(record.owner, {}).setdefault(doctype, []).append(
+                        record.name
+                    )
+
+    for user, records in affected.items():
+        frappe.publish_realtime("sla_status_updated", records, user=user)
@@ -257,3 +257,8 @@ def reset_default_open_view(doctype):
 
     for view in views:
         frappe.db.set_value("CRM View Settings", view, "default_open_view", 0)
+
+    if views:
+        from next_crm.api.doc import clear_doctype_list_meta
+
+        clear_doctype_list_meta(doctype)
@@ -8,6 +8,18 @@ from next_crm.install import after_install
 
 
 class NCRMSettings(Document):
+    def on_update(self):
+        if self.has_value_changed("enable_list_row_projection"):
+            # list views read from the source doctypes until the rebuild has finished
+            self.db_set("list_rows_built", 0)
+            frappe.enqueue(
+                "next_crm.ncrm.doctype.crm_list_row.crm_list_row.rebuild_list_rows",
+                queue="long",
+                job_id="rebuild_crm_list_rows",
+                deduplicate=True,
+                enqueue_after_commit=True,
+            )
+
     @frappe.whitelist()
     def restore_defaults(self, force=False):
         after_install(force)
@@ -6,6 +6,7 @@ from frappe import _
 from frappe.desk.form.assign_to import add as assign
 from frappe.utils import has_gravatar, validate_email_address
 
+from next_crm.ncrm.doctype.crm_list_row.crm_list_row import refresh_list_row
 from next_crm.ncrm.doctype.crm_service_level_agreement.utils import get_sla
 from next_crm.ncrm.doctype.crm_status_change_log.crm_status_change_log import (
     add_status_change_log,
@@ -234,7 +235,10 @@ class Lead(Lead):
                 "reference_type": "Opportunity",
                 "reference_name": opportunity.name,
             })
-
+        if todos:
+            # set_value skips the ToDo hooks that keep the list rows' todo counts
+            refresh_list_row("Lead", self.name)
+            refresh_list_row("Opportunity", opportunity.name)
 
         # Step 5: Handle contact, addresses, etc.
         link_contact_to_doc(contact, "Opportunity", opportunity.name)
@@ -265,9 +269,8 @@ class Lead(Lead):
         """
         if not self.sla:
             return
-        sla = frappe.get_last_doc("CRM Service Level Agreement", {"name": self.sla})
-        if sla:
-            sla.apply(self)
+        sla = frappe.get_cached_doc("CRM Service Level Agreement", self.sla)
+        sla.apply(self)
 
     def convert_to_opportunity(self):
         return convert_to_opportunity(lead=self.name, doc=self)
@@ -147,9 +147,8 @@ class OverrideOpportunity(Opportunity):
         """
         if not self.sla:
             return
-        sla = frappe.get_last_doc("CRM Service Level Agreement", {"name": self.sla})
-        if sla:
-            sla.apply(self)
+        sla = frappe.get_cached_doc("CRM Service Level Agreement", self.sla)
+        sla.apply(self)
 
     @staticmethod
     def default_list_data():
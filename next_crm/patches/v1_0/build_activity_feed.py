@@ -0,0 +1,11 @@
+def execute():
+    from frappe import enqueue
+
+    enqueue(
+        "next_crm.ncrm.doctype.crm_activity.crm_activity.rebuild_activity_feed",
+        queue="long",
+        timeout=7200,
+        job_id="rebuild_activity_feed",
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
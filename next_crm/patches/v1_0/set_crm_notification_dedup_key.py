@@ -0,0 +1,36 @@
+import frappe
+
+from next_crm.ncrm.doctype.crm_notification.crm_notification import (
+    DEDUP_FIELDS,
+    get_dedup_key,
+)
+
+
+def execute():
+    """Set dedup_key of existing notifications, keeping it empty on duplicates of an older one"""
+    seen = set()
+    last_name = ""
+    while True:
+        notifications = frappe.get_all(
+            "CRM Notification",
+            filters={"name": [">", last_name], "dedup_key": ["is", "not set"]},
+            fields=["name", *DEDUP_FIELDS],
+            order_by="name asc",
+            limit=1000,
+        )
+        if not notifications:
+            break
+
+        updates = {}
+        for notification in notifications:
+            dedup_key = get_dedup_key(notification)
+            if dedup_key in seen or frappe.db.exists(
+                "CRM Notification", {"dedup_key": dedup_key}
+            ):
+                continue
+            seen.add(dedup_key)
+            updates[notification.name] = {"dedup_key": dedup_key}
+
+        if updates:
+            frappe.db.bulk_update("CRM Notification", updates, update_modified=False)
+        last_name = notifications[-1].name
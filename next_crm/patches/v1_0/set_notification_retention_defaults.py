@@ -0,0 +1,22 @@
+import frappe
+
+
+def execute():
+    """Store the default retention periods on sites where NCRM Settings was saved before they existed"""
+    Singles = frappe.qb.DocType("Singles")
+    meta = frappe.get_meta("NCRM Settings")
+    for fieldname in (
+        "read_notification_retention_days",
+        "unread_notification_retention_days",
+    ):
+        is_set = (
+            frappe.qb.from_(Singles)
+            .select(Singles.value)
+            .where(Singles.doctype == "NCRM Settings")
+            .where(Singles.field == fieldname)
+            .run()
+        )
+        if not is_set:
+            frappe.db.set_single_value(
+                "NCRM Settings", fieldname, meta.get_field(fieldname).default
+            )
@@ -1,3 +1,4 @@
+import re
 from datetime import datetime
 
 import frappe
@@ -30,3 +31,25 @@ def get_linked_gmail_thread_list(doctype, docname):
         pluck="name",
     )
     return gmail_threads
+
+
+def parse_order_by(order_by):
+    """
+    Split an order by clause into `(fieldname, direction)` pairs
+
+    e.g. "`tabLead`.`modified` desc, name" -> [("modified", "desc"), ("name", "asc")]
+    Parts that do not reference a plain fieldname are skipped.
+    """
+    parsed = []
+    for part in (order_by or "").split(","):
+        tokens = part.split()
+        if not tokens:
+            continue
+        fieldname = tokens[0].replace("`", "").split(".")[-1]
+        if not re.fullmatch(r"\w+", fieldname):
+            continue
+        direction = "asc"
+        if len(tokens) > 1 and tokens[1].lower() == "desc":
+            direction = "desc"
+        parsed.append((fieldname, direction))
+    return parsed